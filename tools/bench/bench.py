@@ -0,0 +1,307 @@
+import argparse
+import collections
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS)
+
+import utils
+from generate import generate
+
+# Converters, their inputs and arguments, and functions of each stage except common
+# ones in utils. Converters with resources are given generated ones.
+CASES = {
+    "db": ("convert_db", "db", [], {"read": ["read_results"]}),
+    "db-passthrough": (
+        "convert_db",
+        "db",
+        ["--passthrough"],
+        {"read": ["read_results"]},
+    ),
+    "ikax3": (
+        "convert_ikax3",
+        "ikax3",
+        [],
+        {
+            "setup": ["extract_database"],
+            "read": ["read_results"],
+            "decode": ["parseFleece"],
+        },
+    ),
+    "s3s": (
+        "convert_s3s_outputs",
+        "s3s",
+        [],
+        {"read": ["list_files", "read_file"]},
+    ),
+    "salmonia3+": (
+        "convert_salmonia3+_backup",
+        "salmonia3+",
+        ["--resource-url", "{resources}", "--cache-dir", "cache"],
+        {
+            "setup": ["warmup"],
+            "read": ["read_results"],
+            "transform": ["convert_result"],
+        },
+    ),
+    "salmdroidNW": (
+        "convert_salmdroidnw_backup",
+        "salmdroidNW",
+        ["--resource-url", "{resources}", "--cache-dir", "cache"],
+        {"setup": ["warmup"], "read": ["read_results"], "transform": ["format_coop"]},
+    ),
+    "stat.ink": (
+        "convert_stat_ink_salmon_run_json",
+        "stat.ink",
+        ["--resource-url", "{resources}", "--cache-dir", "cache"],
+        {
+            "setup": ["warmup"],
+            "read": ["read_results"],
+            "transform": ["convert_result"],
+        },
+    ),
+}
+STAGES = ["setup", "read", "decode", "transform", "write", "other"]
+
+
+class Profiler:
+    # Time spent in each stage excludes time spent in stages nested in it.
+    def __init__(self):
+        self.seconds = collections.Counter()
+        self.stack = []
+
+    def enter(self, stage):
+        self.stack.append([stage, time.perf_counter(), 0])
+
+    def exit(self):
+        stage, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.seconds[stage] += elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def wrap(self, stage, fn):
+        if inspect.isgeneratorfunction(fn):
+
+            def wrapper(*args, **kwargs):
+                # Only time spent in generators is counted, not in their consumers.
+                records = fn(*args, **kwargs)
+                while True:
+                    self.enter(stage)
+                    try:
+                        record = next(records)
+                    except StopIteration:
+                        return
+                    finally:
+                        self.exit()
+                    yield record
+
+        else:
+
+            def wrapper(*args, **kwargs):
+                self.enter(stage)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.exit()
+
+        return functools.wraps(fn)(wrapper)
+
+    def patch(self, obj, name, stage):
+        setattr(obj, name, self.wrap(stage, getattr(obj, name)))
+
+
+def peak_rss():
+    # ru_maxrss keeps the peak of the parent across exec on Linux, while VmHWM is
+    # reset. ru_maxrss is in bytes on macOS and in kilobytes on other platforms.
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run(name, path, resources, profile):
+    # Run a converter in this process and print its measurements.
+    module, _, args, stages = CASES[name]
+    converter = importlib.import_module(module)
+    profiler = Profiler()
+    if profile:
+        for stage, fns in stages.items():
+            for fn in fns:
+                profiler.patch(converter, fn, stage)
+        profiler.patch(utils, "read_array", "read")
+        profiler.patch(utils, "loads", "decode")
+        profiler.patch(utils, "dumps", "write")
+        profiler.patch(utils.Writer, "write", "write")
+        profiler.patch(utils.Writer, "close", "write")
+
+    sys.argv = [f"{module}.py", path, *[x.format(resources=resources) for x in args]]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        converter.main()
+    seconds = time.perf_counter() - start
+
+    stages = dict(profiler.seconds)
+    if profile:
+        stages["other"] = seconds - sum(stages.values())
+    print(json.dumps({"seconds": seconds, "stages": stages, "peakRss": peak_rss()}))
+
+
+def measure(name, path, resources, dir, profile=False):
+    # Converters run in new processes, so their peak RSS is measured separately.
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            os.path.abspath(path),
+            "--run",
+            name,
+            "--resources",
+            os.path.abspath(resources),
+            *(["--profile"] if profile else []),
+        ],
+        cwd=dir,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    measurement = json.loads(result.stdout)
+    with zipfile.ZipFile(f"{dir}/conch-bay-import.zip", "r") as f:
+        measurement["records"] = sum(
+            1 for name in f.namelist() if not name.endswith("/")
+        )
+    return measurement
+
+
+def bench(name, path, resources, repeat):
+    with tempfile.TemporaryDirectory() as dir:
+        # The first run caches resources as they usually are, and is not measured.
+        measure(name, path, resources, dir)
+        # The fastest of repeated runs is taken, and stages are measured in another
+        # run since profiling slows converters down.
+        result = min(
+            (measure(name, path, resources, dir) for _ in range(repeat)),
+            key=lambda x: x["seconds"],
+        )
+        result["stages"] = measure(name, path, resources, dir, True)["stages"]
+    result["recordsPerSecond"] = result["records"] / result["seconds"]
+    return result
+
+
+def compare(results, baseline, threshold):
+    # Return names of cases whose throughput drops more than the threshold.
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result["recordsPerSecond"] / baseline[name]["recordsPerSecond"]
+            result["baselineRatio"] = ratio
+            if ratio < 1 - threshold:
+                regressions.append(name)
+    return regressions
+
+
+def format_results(results):
+    lines = [
+        f"{'case':<16}{'records':>9}{'seconds':>9}{'records/s':>11}{'peak RSS':>10}"
+        + "".join(f"{stage:>11}" for stage in STAGES)
+        + f"{'baseline':>10}"
+    ]
+    for name, result in results.items():
+        line = (
+            f"{name:<16}{result['records']:>9}{result['seconds']:>9.3f}"
+            f"{result['recordsPerSecond']:>11.0f}"
+            f"{result['peakRss'] / 1024 / 1024:>8.1f}MB"
+        )
+        total = sum(result["stages"].values())
+        for stage in STAGES:
+            line += f"{result['stages'].get(stage, 0) / total:>11.1%}"
+        if "baselineRatio" in result:
+            line += f"{result['baselineRatio']:>9.2f}x"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+        "path",
+        nargs="?",
+        default=os.path.join(utils.default_cache_dir(), "bench"),
+        help="directory of generated inputs",
+    )
+    argument_parser.add_argument(
+        "--size", type=int, default=1000, help="number of results in each input"
+    )
+    argument_parser.add_argument(
+        "--only", nargs="+", choices=CASES.keys(), help="only run these cases"
+    )
+    argument_parser.add_argument(
+        "--repeat", type=int, default=3, help="number of measured runs of each case"
+    )
+    argument_parser.add_argument(
+        "--baseline", help="JSON of previous results to compare with"
+    )
+    argument_parser.add_argument(
+        "--save-baseline", help="save results as a baseline in JSON"
+    )
+    argument_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="fail if throughput drops more than this ratio from the baseline",
+    )
+    argument_parser.add_argument(
+        "--json", action="store_true", help="print results in JSON"
+    )
+    argument_parser.add_argument("--run", help=argparse.SUPPRESS)
+    argument_parser.add_argument("--resources", help=argparse.SUPPRESS)
+    argument_parser.add_argument(
+        "--profile", action="store_true", help=argparse.SUPPRESS
+    )
+    args = argument_parser.parse_args()
+
+    if args.run is not None:
+        run(args.run, args.path, args.resources, args.profile)
+        return
+
+    names = args.only or list(CASES.keys())
+    paths = generate(args.path, args.size, {CASES[name][1] for name in names})
+    results = {}
+    for name in names:
+        results[name] = bench(
+            name, paths[CASES[name][1]], f"{args.path}/resources", args.repeat
+        )
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_results(results))
+        for name in regressions:
+            print(f'Throughput of "{name}" dropped more than {args.threshold:.0%}.')
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import struct
+
+
+def encodeVarint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if not n:
+            out.append(b)
+            return bytes(out)
+        out.append(b | 0x80)
+
+
+# Fleece encoder for the subset decoded by convert_ikax3.py. Values are written
+# before the collections referring to them, strings are deduplicated, and empty
+# collections are inline.
+class FleeceEncoder:
+    def __init__(self, shared=None):
+        self.out = bytearray()
+        self.strings = {}
+        self.shared = {key: i for i, key in enumerate(shared or [])}
+
+    def align(self):
+        if len(self.out) & 1:
+            self.out.append(0)
+
+    def inline(self, value):
+        if value is None:
+            return b"\x30\x00"
+        if value is False:
+            return b"\x34\x00"
+        if value is True:
+            return b"\x38\x00"
+        if type(value) is int and -2048 <= value <= 2047:
+            return bytes([(value >> 8) & 0x0F, value & 0xFF])
+        if type(value) is list and not value:
+            return b"\x60\x00"
+        if type(value) is dict and not value:
+            return b"\x70\x00"
+        if type(value) is str and len(value.encode("utf-8")) <= 1:
+            data = value.encode("utf-8")
+            return bytes([0x40 | len(data)]) + data.ljust(1, b"\x00")
+        return None
+
+    def offset(self):
+        self.align()
+        return len(self.out)
+
+    def write(self, value):
+        # Return an inline value or the offset of the value.
+        inline = self.inline(value)
+        if inline is not None:
+            return inline
+        if type(value) is int:
+            if value < 0 or value < 1 << 63:
+                data = value.to_bytes(8, "little", signed=True)
+                unsigned = 0
+            else:
+                data = value.to_bytes(8, "little")
+                unsigned = 1
+            data = data.rstrip(b"\xff" if value < 0 else b"\x00") or data[:1]
+            if (value < 0) != bool(data[-1] & 0x80) and not unsigned:
+                data += b"\xff" if value < 0 else b"\x00"
+            i = self.offset()
+            self.out += bytes([0x10 | unsigned << 3 | len(data) - 1]) + data
+            return i
+        if type(value) is float:
+            i = self.offset()
+            self.out += b"\x28\x00" + struct.pack("<d", value)
+            return i
+        if type(value) is str:
+            if value in self.strings:
+                return self.strings[value]
+            i = self.strings[value] = self.write_bytes(0x40, value.encode("utf-8"))
+            return i
+        if type(value) is bytes:
+            return self.write_bytes(0x50, value)
+        if type(value) is list:
+            return self.write_collection(0x60, [self.write(x) for x in value])
+        if type(value) is dict:
+            items = []
+            for key, x in value.items():
+                if key in self.shared:
+                    items.append(self.inline(self.shared[key]))
+                else:
+                    items.append(self.write(key))
+                items.append(self.write(x))
+            return self.write_collection(0x70, items, len(value))
+        raise TypeError(f"{type(value).__name__} is not supported")
+
+    def write_bytes(self, tag, data):
+        i = self.offset()
+        if len(data) >= 0x0F:
+            self.out += bytes([tag | 0x0F]) + encodeVarint(len(data)) + data
+        else:
+            self.out += bytes([tag | len(data)]) + data
+        return i
+
+    def write_collection(self, tag, items, count=None):
+        if count is None:
+            count = len(items)
+        i = self.offset()
+        extra = b""
+        if count >= 0x7FF:
+            extra = encodeVarint(count - 0x7FF)
+            if len(extra) & 1:
+                extra += b"\x00"
+        first = i + 2 + len(extra)
+        wide = any(
+            type(item) is int and (first + 2 * j - item) // 2 >= 0x8000
+            for j, item in enumerate(items)
+        )
+        width = 4 if wide else 2
+        header = min(count, 0x7FF)
+        self.out += bytes([tag | (0x08 if wide else 0) | header >> 8, header & 0xFF])
+        self.out += extra
+        for j, item in enumerate(items):
+            if type(item) is bytes:
+                self.out += item.ljust(width, b"\x00")
+            else:
+                distance = (first + width * j - item) // 2
+                if wide:
+                    self.out += struct.pack(">I", 0x80000000 | distance)
+                else:
+                    self.out += struct.pack(">H", 0x8000 | distance)
+        return i
+
+    def finish(self, value):
+        # The root is a narrow pointer at the end, or a wide pointer followed by a
+        # narrow pointer to it.
+        i = self.write(value)
+        self.align()
+        if type(i) is bytes:
+            self.out += i
+            return bytes(self.out)
+        distance = (len(self.out) - i) // 2
+        if distance < 0x8000:
+            self.out += struct.pack(">H", 0x8000 | distance)
+        else:
+            self.out += struct.pack(">I", 0x80000000 | distance)
+            self.out += struct.pack(">H", 0x8000 | 2)
+        return bytes(self.out)
+
+
+def encodeFleece(value, shared=None):
+    return FleeceEncoder(shared).finish(value)
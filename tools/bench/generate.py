@@ -0,0 +1,577 @@
+from base64 import b64encode
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import uuid
+import zipfile
+
+from fleece import encodeFleece
+
+USER = "bench0000000000000000"
+SHARED_KEYS = ["__typename", "id", "name", "image", "url", "playedTime", "weapon"]
+SPECIAL_WEAPON_KEYS = ["nicedama", "hopsonar", "megaphone51", "jetpack"]
+IMAGE_PREFIX = re.compile(r"https://example\.com/[^\"]*/")
+
+
+def played_time(i):
+    # Results are 10 minutes apart, and every 50th result is played at the same
+    # second of the previous one.
+    return 1700000000 + (i - i // 50) * 600
+
+
+def format_time(time, format="%Y-%m-%dT%H:%M:%SZ"):
+    return datetime.datetime.fromtimestamp(time, datetime.timezone.utc).strftime(format)
+
+
+def played_time_of(detail):
+    return int(
+        datetime.datetime.fromisoformat(
+            detail["playedTime"].replace("Z", "+00:00")
+        ).timestamp()
+    )
+
+
+def encode_id(id):
+    return b64encode(id.encode("utf-8")).decode("utf-8")
+
+
+def image(rnd, path):
+    return {"url": f"https://example.com/{path}/{rnd.getrandbits(256):064x}_0.png"}
+
+
+def generate_battle(i):
+    rnd = random.Random(i)
+    time = format_time(played_time(i), "%Y%m%dT%H%M%S")
+    id = f"{USER}:RECENT:{time}_{uuid.UUID(int=rnd.getrandbits(128))}"
+
+    def player(team, n):
+        return {
+            "__isPlayer": "VsPlayer",
+            "byname": "Bench",
+            "name": f"P{team}{n}",
+            "nameId": f"{rnd.randint(0, 9999):04d}",
+            "nameplate": {
+                "badges": [
+                    {
+                        "id": encode_id(f"Badge-{rnd.randint(0, 99)}"),
+                        "image": image(rnd, "badge_img"),
+                    },
+                    None,
+                    None,
+                ],
+                "background": {
+                    "textColor": {"a": 1, "b": 0.5, "g": 0.5, "r": 1},
+                    "id": encode_id(f"NameplateBackground-{rnd.randint(0, 99)}"),
+                    "image": image(rnd, "npl_img"),
+                },
+            },
+            "isMyself": team == 0 and n == 0,
+            "id": encode_id(f"VsPlayer-u-{id}:u-{team}{n}{rnd.getrandbits(64):x}"),
+            "species": "INKLING",
+            "weapon": {
+                "id": encode_id(f"Weapon-{rnd.randint(0, 50) * 10}"),
+                "name": "",
+                "image": image(rnd, "weapon_illust"),
+            },
+            "paint": rnd.randint(0, 2000),
+            "result": {"kill": rnd.randint(0, 20), "death": rnd.randint(0, 20)},
+            "headGear": {"name": "", "image": image(rnd, "gear_img")},
+            "clothingGear": {"name": "", "image": image(rnd, "gear_img")},
+            "shoesGear": {"name": "", "image": image(rnd, "gear_img")},
+        }
+
+    return {
+        "vsHistoryDetail": {
+            "__typename": "VsHistoryDetail",
+            "id": encode_id(f"VsHistoryDetail-u-{id}"),
+            "vsRule": {"name": "", "id": encode_id(f"VsRule-{rnd.randint(0, 4)}")},
+            "vsMode": {"name": "", "id": encode_id(f"VsMode-{rnd.randint(1, 8)}")},
+            "player": player(0, 0),
+            "judgement": rnd.choice(["WIN", "LOSE"]),
+            "myTeam": {"players": [player(0, n) for n in range(4)]},
+            "vsStage": {
+                "name": "",
+                "id": encode_id(f"VsStage-{rnd.randint(1, 20)}"),
+                "image": image(rnd, "stage_img"),
+            },
+            "otherTeams": [{"players": [player(1, n) for n in range(4)]}],
+            "awards": [{"name": "", "rank": "GOLD"}, {"name": "", "rank": "SILVER"}],
+            "duration": rnd.randint(60, 300),
+            "playedTime": format_time(played_time(i)),
+        }
+    }
+
+
+def generate_coop(i):
+    rnd = random.Random(-i - 1)
+    time = format_time(played_time(i), "%Y%m%dT%H%M%S")
+    id = f"{USER}:{time}_{uuid.UUID(int=rnd.getrandbits(128))}"
+
+    def member_result(n):
+        return {
+            "player": {
+                "__isPlayer": "CoopPlayer",
+                "byname": "Bench",
+                "name": f"P{n}",
+                "nameId": f"{rnd.randint(0, 9999):04d}",
+                "nameplate": {
+                    "badges": [None, None, None],
+                    "background": {
+                        "textColor": {"a": 1, "b": 0.5, "g": 0.5, "r": 1},
+                        "id": encode_id(f"NameplateBackground-{rnd.randint(0, 99)}"),
+                        "image": image(rnd, "npl_img"),
+                    },
+                },
+                "uniform": {
+                    "name": "",
+                    "id": encode_id(f"CoopUniform-{rnd.randint(0, 9)}"),
+                    "image": image(rnd, "coop_skin_img"),
+                },
+                "id": encode_id(f"CoopPlayer-u-{id}:u-{n}{rnd.getrandbits(64):x}"),
+                "species": "INKLING",
+            },
+            "weapons": [
+                {"name": "", "image": image(rnd, "weapon_illust")} for _ in range(3)
+            ],
+            "specialWeapon": {
+                "name": "",
+                "weaponId": 20006,
+                "image": image(rnd, "special_img/blue"),
+            },
+            "defeatEnemyCount": rnd.randint(0, 30),
+            "deliverCount": rnd.randint(0, 2000),
+            "goldenAssistCount": rnd.randint(0, 20),
+            "goldenDeliverCount": rnd.randint(0, 40),
+            "rescueCount": rnd.randint(0, 5),
+            "rescuedCount": rnd.randint(0, 5),
+        }
+
+    return {
+        "coopHistoryDetail": {
+            "__typename": "CoopHistoryDetail",
+            "id": encode_id(f"CoopHistoryDetail-u-{id}"),
+            "afterGrade": {"name": "", "id": encode_id("CoopGrade-8")},
+            "myResult": member_result(0),
+            "memberResults": [member_result(n) for n in range(1, 4)],
+            "bossResult": None,
+            "enemyResults": [
+                {
+                    "defeatCount": rnd.randint(0, 10),
+                    "teamDefeatCount": rnd.randint(0, 20),
+                    "popCount": rnd.randint(0, 30),
+                    "enemy": {
+                        "name": "",
+                        "id": encode_id(f"CoopEnemy-{n}"),
+                        "image": image(rnd, "coop_enemy_img"),
+                    },
+                }
+                for n in range(4, 16)
+            ],
+            "waveResults": [
+                {
+                    "waveNumber": n,
+                    "waterLevel": rnd.randint(0, 2),
+                    "eventWave": None,
+                    "deliverNorm": 20,
+                    "goldenPopCount": rnd.randint(20, 60),
+                    "teamDeliverCount": rnd.randint(20, 40),
+                    "specialWeapons": [],
+                }
+                for n in range(1, 4)
+            ],
+            "resultWave": 0,
+            "playedTime": format_time(played_time(i)),
+            "rule": "REGULAR",
+            "coopStage": {
+                "name": "",
+                "id": encode_id(f"CoopStage-{rnd.randint(1, 9)}"),
+                "image": image(rnd, "stage_img"),
+            },
+            "dangerRate": rnd.randint(100, 333) / 100,
+            "scenarioCode": None,
+            "smellMeter": rnd.randint(0, 5),
+            "weapons": [
+                {"name": "", "image": image(rnd, "weapon_illust")} for _ in range(4)
+            ],
+            "afterGradePoint": rnd.randint(0, 999),
+            "scale": None,
+            "jobPoint": rnd.randint(0, 300),
+            "jobScore": rnd.randint(0, 300),
+            "jobRate": rnd.randint(100, 325) / 100,
+            "jobBonus": 100,
+            "nextHistoryDetail": None,
+            "previousHistoryDetail": None,
+        }
+    }
+
+
+def generate_results(size):
+    # Two thirds of results are battles, and the others are coops.
+    battles = (generate_battle(i) for i in range(size) if i % 3)
+    coops = (generate_coop(i) for i in range(size) if not i % 3)
+    return battles, coops
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def generate_db(path, size):
+    # The schema is the same as the one in utils/database.ts.
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE brief ( id TEXT PRIMARY KEY, time INT NOT NULL, mode TEXT NOT NULL, rule TEXT NOT NULL, stage TEXT NOT NULL, weapon TEXT NOT NULL, players TEXT NOT NULL, brief TEXT NOT NULL )"
+        )
+        conn.execute(
+            "CREATE TABLE detail ( id TEXT PRIMARY KEY, time INT NOT NULL, mode TEXT NOT NULL, detail TEXT NOT NULL )"
+        )
+        battles, coops = generate_results(size)
+        for battle in battles:
+            detail = battle["vsHistoryDetail"]
+            row = (detail["id"], played_time_of(detail) * 1000)
+            conn.execute(
+                "INSERT INTO brief VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    *row,
+                    "bankara",
+                    detail["vsRule"]["id"],
+                    detail["vsStage"]["id"],
+                    detail["player"]["weapon"]["id"],
+                    "",
+                    "{}",
+                ),
+            )
+            conn.execute(
+                "INSERT INTO detail VALUES (?, ?, ?, ?)",
+                (*row, "bankara", dumps(battle)),
+            )
+        for coop in coops:
+            detail = coop["coopHistoryDetail"]
+            row = (detail["id"], played_time_of(detail) * 1000)
+            conn.execute(
+                "INSERT INTO brief VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    *row,
+                    "salmon_run",
+                    detail["rule"],
+                    detail["coopStage"]["id"],
+                    "",
+                    "",
+                    "{}",
+                ),
+            )
+            conn.execute(
+                "INSERT INTO detail VALUES (?, ?, ?, ?)",
+                (*row, "salmon_run", dumps(coop)),
+            )
+    conn.close()
+
+
+def generate_s3s(path, size, bundle_size=100):
+    # Half of results are files in exports, and the others are in export-*
+    # bundles.
+    os.makedirs(f"{path}/exports/results")
+    os.makedirs(f"{path}/exports/coop_results")
+    with open(f"{path}/exports/overview.json", "w", encoding="utf-8") as f:
+        f.write("[]\n")
+    battles, coops = generate_results(size)
+    bundles = {}
+    for results, dir, name in [
+        (battles, "results", "results.json"),
+        (coops, "coop_results", "coop_results.json"),
+    ]:
+        bundles[name] = []
+        for i, result in enumerate(results):
+            if i % 2:
+                bundles[name].append({"data": result})
+            else:
+                with open(f"{path}/exports/{dir}/{i}.json", "w", encoding="utf-8") as f:
+                    f.write(dumps({"data": result}))
+    # Bundles always contain both files.
+    for n in range(0, max(map(len, bundles.values())), bundle_size):
+        os.makedirs(f"{path}/export-{n // bundle_size}")
+        for name, results in bundles.items():
+            with open(
+                f"{path}/export-{n // bundle_size}/{name}", "w", encoding="utf-8"
+            ) as f:
+                f.write(dumps(results[n : n + bundle_size]))
+
+
+def generate_ikax3(path, size):
+    with tempfile.TemporaryDirectory() as dir:
+        account = "bench"
+        battles, coops = generate_results(size)
+        for name, results, key in [
+            ("vsResult", battles, "vsHistoryDetail"),
+            ("coopResult", coops, "coopHistoryDetail"),
+        ]:
+            os.makedirs(f"{dir}/{account}/{name}.cblite2")
+            with sqlite3.connect(f"{dir}/{account}/{name}.cblite2/db.sqlite3") as conn:
+                conn.execute("CREATE TABLE kv_info (key TEXT, body BLOB)")
+                conn.execute("CREATE TABLE kv_default (key TEXT, body BLOB)")
+                conn.execute(
+                    "INSERT INTO kv_info VALUES ('SharedKeys', ?)",
+                    (encodeFleece(SHARED_KEYS),),
+                )
+                for result in results:
+                    conn.execute(
+                        "INSERT INTO kv_default VALUES (?, ?)",
+                        (result[key]["id"], encodeFleece(result[key], SHARED_KEYS)),
+                    )
+            conn.close()
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as f:
+            f.writestr("account.json", json.dumps({"id": account}))
+            for name in ["vsResult", "coopResult"]:
+                f.write(
+                    f"{dir}/{account}/{name}.cblite2/db.sqlite3",
+                    f"{account}/{name}.cblite2/db.sqlite3",
+                )
+
+
+def generate_resources(path, version="bench"):
+    # Leanny resources in the layout read by utils.Resources.
+    os.makedirs(f"{path}/{version}")
+    with open(f"{path}/latest", "w", encoding="utf-8") as f:
+        f.write(version)
+    tables = {
+        "NamePlateBgInfo": [{"Id": i, "__RowId": f"Npl_{i}"} for i in range(20)],
+        "BadgeInfo": [{"Id": i, "Name": f"Badge_{i}"} for i in range(20)],
+        "CoopSkinInfo": [{"Id": i, "__RowId": f"COP{i:03d}"} for i in range(10)],
+        "WeaponInfoMain": [
+            {"Id": i, "__RowId": f"Wpn_{i}", "IsCoopRare": i >= 20000}
+            for i in list(range(0, 60, 10)) + [20000, 20010]
+        ],
+        "WeaponInfoSpecial": [
+            {"Id": i, "__RowId": f"Sp_{i}_Coop"} for i in range(20000, 20020)
+        ],
+        "CoopSceneInfo": [{"Id": i, "__RowId": f"Cop_{i}"} for i in range(1, 10)],
+    }
+    for name, table in tables.items():
+        with open(f"{path}/{version}/{name}.json", "w", encoding="utf-8") as f:
+            json.dump(table, f)
+
+
+def generate_salmonia(path, size):
+    rnd = random.Random(0)
+    schedules = [
+        {
+            "rule": "REGULAR",
+            "stageId": rnd.randint(1, 9),
+            "weaponList": [0, 10, 20, 30],
+            "results": [],
+        }
+        for _ in range(max(1, size // 20))
+    ]
+    for i in range(size):
+        players = [
+            {
+                "bossKillCounts": [rnd.randint(0, 3) for _ in range(14)],
+                "specialCounts": [1, 0, 1],
+                "specialId": 20006 + n,
+                "background": rnd.randint(0, 19),
+                "textColor": [1, 0.5, 0.5, 1],
+                "badges": [rnd.randint(0, 19), None, rnd.randint(0, 19)],
+                "uniform": rnd.randint(0, 9),
+                "byname": "Bench",
+                "name": f"P{n}",
+                "nameId": f"{rnd.randint(0, 9999):04d}",
+                "nplnUserId": f"user{n}",
+                "species": "INKLING",
+                "weaponList": [rnd.randint(0, 5) * 10 for _ in range(3)],
+                "bossKillCountsTotal": rnd.randint(0, 30),
+                "ikuraNum": rnd.randint(0, 2000),
+                "goldenIkuraAssistNum": rnd.randint(0, 20),
+                "goldenIkuraNum": rnd.randint(0, 40),
+                "helpCount": rnd.randint(0, 5),
+                "deadCount": rnd.randint(0, 5),
+            }
+            for n in range(4)
+        ]
+        waves = [
+            {
+                "waveId": n + 1,
+                "waterLevel": rnd.randint(0, 2),
+                "eventType": rnd.randint(0, 2),
+                "quotaNum": 20,
+                "goldenIkuraPopNum": rnd.randint(20, 60),
+                "goldenIkuraNum": rnd.randint(20, 40),
+            }
+            for n in range(3)
+        ]
+        schedules[i % len(schedules)]["results"].append(
+            {
+                "bossCounts": [rnd.randint(0, 3) for _ in range(14)],
+                "bossKillCounts": [rnd.randint(0, 3) for _ in range(14)],
+                "players": players,
+                "waves": waves,
+                "nplnUserId": "user0",
+                "playTime": format_time(played_time(i)),
+                "uuid": str(uuid.UUID(int=rnd.getrandbits(128))).upper(),
+                "gradeId": 8,
+                "bossId": 23 if i % 2 else None,
+                "isBossDefeated": bool(i % 4),
+                "failureWave": None,
+                "dangerRate": rnd.randint(100, 333) / 100,
+                "scenarioCode": None,
+                "smellMeter": rnd.randint(0, 5),
+                "gradePoint": rnd.randint(0, 999),
+                "scale": [1, 2, 3],
+                "kumaPoint": rnd.randint(0, 300),
+                "jobScore": rnd.randint(0, 300),
+                "jobRate": rnd.randint(100, 325) / 100,
+                "jobBonus": 100,
+            }
+        )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as f:
+        f.writestr("backup.json", dumps({"version": 1, "schedules": schedules}))
+
+
+def generate_salmdroid(path, size, batch_size=50):
+    # salmdroidNW keeps file names of images only.
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as f:
+        for n in range(0, size, batch_size):
+            results = [
+                {
+                    "coopHistory": IMAGE_PREFIX.sub(
+                        "", dumps(generate_coop(i)["coopHistoryDetail"])
+                    )
+                }
+                for i in range(n, min(size, n + batch_size))
+            ]
+            f.writestr(str(n // batch_size + 1), dumps({"results": dumps(results)}))
+
+
+def generate_stat_ink(path, size):
+    rnd = random.Random(0)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            time = played_time(i)
+            waves = [
+                {
+                    "special_uses": {
+                        "a": {
+                            "count": rnd.randint(1, 2),
+                            "special": {"key": rnd.choice(SPECIAL_WEAPON_KEYS)},
+                        }
+                    },
+                    "tide": {"key": "normal"},
+                    "event": {"key": "rush"} if n == 1 else None,
+                    "golden_quota": 20,
+                    "golden_appearances": rnd.randint(20, 60),
+                    "golden_delivered": rnd.randint(20, 40),
+                    "danger_rate": rnd.randint(100, 333),
+                }
+                for n in range(3)
+            ]
+            players = [
+                {
+                    "name": f"P{n}",
+                    "number": f"{rnd.randint(0, 9999):04d}",
+                    "special": {"key": SPECIAL_WEAPON_KEYS[n]},
+                    "splashtag_title": "Bench",
+                    "uniform": {"aliases": [str(rnd.randint(0, 9))]},
+                    "weapons": [{"aliases": [str(rnd.randint(0, 5) * 10)]}, None],
+                    "defeat_boss": rnd.randint(0, 30),
+                    "power_eggs": rnd.randint(0, 2000),
+                    "golden_assist": rnd.randint(0, 20),
+                    "golden_eggs": rnd.randint(0, 40),
+                    "rescue": rnd.randint(0, 5),
+                    "rescued": rnd.randint(0, 5),
+                    "disconnected": False,
+                }
+                for n in range(4)
+            ]
+            result = {
+                "waves": waves,
+                "players": players,
+                "start_at": {
+                    "time": time,
+                    "iso8601": format_time(time, "%Y-%m-%dT%H:%M:%S+00:00"),
+                },
+                "uuid": str(uuid.UUID(int=rnd.getrandbits(128))),
+                "title_after": {"aliases": ["8"]},
+                "king_salmonid": {"aliases": ["23"]} if i % 2 else None,
+                "clear_extra": True,
+                "bosses": {
+                    "a": {
+                        "defeated_by_me": rnd.randint(0, 5),
+                        "defeated": rnd.randint(0, 10),
+                        "appearances": rnd.randint(0, 15),
+                        "boss": {"aliases": ["4"]},
+                    }
+                },
+                "clear_waves": 3,
+                "eggstra_work": False,
+                "big_run": False,
+                "stage": {"aliases": [str(rnd.randint(1, 9))]},
+                "danger_rate": rnd.randint(100, 333),
+                "king_smell": rnd.randint(0, 5),
+                "title_exp_after": rnd.randint(0, 999),
+                "gold_scale": 1,
+                "silver_scale": 2,
+                "bronze_scale": 3,
+                "job_point": rnd.randint(0, 300),
+                "job_score": rnd.randint(0, 300),
+                "job_rate": rnd.randint(100, 325) / 100,
+                "job_bonus": 100,
+            }
+            f.write(dumps(result) + "\n")
+
+
+GENERATORS = {
+    "db": ("app.db", generate_db),
+    "s3s": ("s3s", generate_s3s),
+    "ikax3": ("ikax3.ikax3", generate_ikax3),
+    "salmonia3+": ("salmonia3+.zip", generate_salmonia),
+    "salmdroidNW": ("salmdroidnw.zip", generate_salmdroid),
+    "stat.ink": ("stat_ink.jsonl", generate_stat_ink),
+}
+
+
+def generate(path, size, names=None):
+    # Generate inputs which are not generated yet, and return their paths.
+    paths = {}
+    os.makedirs(path, exist_ok=True)
+    if not os.path.exists(f"{path}/resources"):
+        generate_resources(f"{path}/resources")
+    for name, (file, fn) in GENERATORS.items():
+        if names is None or name in names:
+            paths[name] = f"{path}/{size}/{file}"
+            if not os.path.exists(paths[name]):
+                os.makedirs(f"{path}/{size}", exist_ok=True)
+                fn(paths[name], size)
+    return paths
+
+
+def main():
+    if len(sys.argv) <= 1:
+        print(
+            f'Please specify the directory of generated inputs with "python3 {sys.argv[0]} <PATH>".'
+        )
+        return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    argument_parser.add_argument(
+        "--size", type=int, default=1000, help="number of results in each input"
+    )
+    argument_parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=GENERATORS.keys(),
+        help="only generate these inputs",
+    )
+    args = argument_parser.parse_args()
+
+    paths = generate(args.path, args.size, args.only)
+    for name, path in paths.items():
+        print(f'Generate {args.size} results of {name} to "{path}".')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+import math
+import os
+import random
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+
+def dumps_without_orjson(obj):
+    orjson, utils.orjson = utils.orjson, None
+    try:
+        return utils.dumps(obj)
+    finally:
+        utils.orjson = orjson
+
+
+@unittest.skipIf(utils.orjson is None, "orjson is not installed")
+class DumpsTest(unittest.TestCase):
+    def assertSameBytes(self, obj):
+        self.assertEqual(utils.dumps(obj), dumps_without_orjson(obj), obj)
+
+    def test_floats_in_exponent_notation(self):
+        for value in [1e300, 1e16, 1.5e16, -1.2345678901234568e17, 8.46e-05, 2.5e-05]:
+            self.assertSameBytes({"value": value, "values": [value, -value]})
+            self.assertSameBytes(value)
+
+    def test_floats_near_boundaries(self):
+        for value in [0.0, -0.0, 1e-4, 0.0001234, 9.99e-5, 1e15, 9999999999999998.0]:
+            self.assertSameBytes([value, {"value": value}])
+
+    def test_random_floats(self):
+        rnd = random.Random(0)
+        for _ in range(10000):
+            value = struct.unpack("<d", struct.pack("<Q", rnd.getrandbits(64)))[0]
+            if math.isfinite(value):
+                self.assertSameBytes([value])
+            value = rnd.uniform(-1, 1) * 10 ** rnd.uniform(-8, 20)
+            self.assertSameBytes({"value": value})
+
+    def test_strings_like_floats(self):
+        self.assertSameBytes({"id": ":1e5,0.00001[2e-3", "name": "é \x00"})
+        self.assertSameBytes({"name": 'a "1e5" \\', "value": 1.5, "values": [2e-5]})
+
+    def test_non_finite_floats(self):
+        obj = {"value": math.nan, "values": [math.inf, -math.inf, 1.5]}
+        self.assertSameBytes(obj)
+        self.assertEqual(
+            json.loads(utils.dumps(obj)), {"value": None, "values": [None, None, 1.5]}
+        )
+
+    def test_large_integers(self):
+        self.assertSameBytes({"value": 2**70, "values": [-(2**64), 2**63 - 1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
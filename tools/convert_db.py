@@ -1,29 +1,68 @@
-import json
+import argparse
 import sqlite3
 import sys
 import utils
 
 
+def read_results(path, coop, passthrough=False, batch_size=1000):
+    with sqlite3.connect(path) as conn:
+        cur = conn.cursor()
+        # Duplicated IDs are resolved to their first inserted rows.
+        cur.execute(f"""
+            SELECT id, time, {'CAST(detail AS BLOB)' if passthrough else 'detail'} FROM detail
+            WHERE mode {'=' if coop else '!='} 'salmon_run'
+            AND rowid IN (SELECT MIN(rowid) FROM detail GROUP BY id)
+            ORDER BY time
+            """)
+        while rows := cur.fetchmany(batch_size):
+            yield from rows
+
+
 def main():
     if len(sys.argv) <= 1:
         print(f'Please specify the database with "python3 {sys.argv[0]} <PATH>".')
         return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    argument_parser.add_argument(
+        "--passthrough",
+        action="store_true",
+        help="write stored details into the archive as is without parsing",
+    )
+    argument_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of rows fetched from the database at a time",
+    )
+    utils.add_output_arguments(argument_parser)
+    args = argument_parser.parse_args()
 
-    ids = set()
-    battles = []
-    coops = []
-    with sqlite3.connect(sys.argv[1]) as conn:
-        cur = conn.cursor()
-        for row in cur.execute("SELECT id, mode, detail FROM detail"):
-            if row[0] not in ids:
-                ids.add(row[0])
-                if row[1] == "salmon_run":
-                    coops.append(json.loads(row[2]))
-                else:
-                    battles.append(json.loads(row[2]))
-
-    utils.write_out("conch-bay-import", battles, coops)
-    print(f'Export {len(ids)} results to "conch-bay-import.zip".')
+    manifest = utils.load_manifest(args)
+
+    battles = read_results(args.path, False, args.passthrough, args.batch_size)
+    coops = read_results(args.path, True, args.passthrough, args.batch_size)
+    if manifest is not None:
+        battles, coops = manifest.new(args.path, battles, coops, lambda x: x[0])
+
+    path = utils.output_path("conch-bay-import", manifest)
+    if args.passthrough:
+        # The time column stores the played time in milliseconds.
+        with utils.Writer(path, args.compress_level, manifest) as writer:
+            for battle in battles:
+                writer.write("battles", battle[1] // 1000, battle[2], battle[0])
+            for coop in coops:
+                writer.write("coops", coop[1] // 1000, coop[2], coop[0])
+        count = writer.count
+    else:
+        count = utils.write_out(
+            path,
+            utils.pipe(battles, lambda x: utils.loads(x[2])),
+            utils.pipe(coops, lambda x: utils.loads(x[2])),
+            args.compress_level,
+            manifest,
+        )
+    utils.print_export(count, path, manifest)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
-import json
+import argparse
+import collections.abc
+import concurrent.futures
+import pathlib
 import sqlite3
 import struct
 import sys
@@ -7,116 +10,327 @@ import zipfile
 import utils
 
 
-def parseFleece(blob, shared=None, i=None, w=False):
-    if i is None:
-        i = len(blob) - 2
+def readVarint(blob, i):
+    value = 0
+    shift = 0
+    while True:
+        value = value + ((blob[i] & 0b1111111) << shift)
+        i = i + 1
+        if not blob[i - 1] & 0b10000000:
+            return value, i
+        shift = shift + 7
 
-    if blob[i] < 0b10000:
+
+def derefFleece(blob, i, w=False):
+    # Pointer [1ooooooo oooooooo], targets of pointers are always wide.
+    if not w and blob[i] & 0b10000000:
+        i = i - 2 * (((blob[i] & 0b1111111) << 8) + blob[i + 1])
+    while blob[i] & 0b10000000:
+        i = i - 2 * (struct.unpack_from(">I", blob, i)[0] & 0x7FFFFFFF)
+    return i
+
+
+def parseFleeceCollection(blob, i):
+    # Array [0110wccc cccccccc...] and dictionary [0111wccc cccccccc...].
+    wide = True if (blob[i] & 0b1000) >> 3 else False
+    count = ((blob[i] & 0b111) << 8) + blob[i + 1]
+    first = i + 2
+    if count == 0b111_11111111:
+        # Collection with varint elements count, elements start at the next even offset.
+        extra, end = readVarint(blob, first)
+        count = count + extra
+        first = end + ((end - first) & 1)
+    return wide, count, first
+
+
+def parseFleeceScalar(blob, i):
+    tag = blob[i] >> 4
+    if tag == 0b0100 or tag == 0b0101:
+        # String [0100cccc ssssssss...] and binary data [0101cccc dddddddd...].
+        count = blob[i] & 0b1111
+        start = i + 1
+        if count == 0b1111:
+            count, start = readVarint(blob, start)
+        if tag == 0b0100:
+            return str(blob[start : start + count], "utf-8")
+        return bytes(blob[start : start + count])
+    elif tag == 0b0000:
         # Small integer [0000iiii iiiiiiii].
-        symbol = True if (blob[i] & 0b1000) >> 3 else False
-        comp = ((blob[i] & 0b111) << 8) + blob[i + 1]
-        if symbol:
-            return -((comp ^ 0b111_11111111) + 1)
-        return comp
-    elif blob[i] < 0b100000:
+        value = ((blob[i] & 0b1111) << 8) + blob[i + 1]
+        return value - 0b10000_00000000 if value & 0b1000_00000000 else value
+    elif tag == 0b0001:
         # Long integer [0001uccc iiiiiiii...].
         unsigned = True if (blob[i] & 0b1000) >> 3 else False
         count = (blob[i] & 0b111) + 1
-        value = 0
-        j = 0
-        while j < count:
-            if (not unsigned) and j == count - 1:
-                symbol = True if (blob[i + 1 + j] & 0b10000000) >> 7 else False
-                value = value + ((blob[i + 1 + j] & 0b1111111) << 8 * j)
-                if symbol:
-                    # Long integer with symbol set is not supported.
-                    raise NotImplementedError()
-            else:
-                value = value + (blob[i + 1 + j] << 8 * j)
-            j = j + 1
-        return value
-    elif blob[i] < 0b110000:
+        return int.from_bytes(
+            blob[i + 1 : i + 1 + count], "little", signed=not unsigned
+        )
+    elif tag == 0b0010:
         # Floating point [0010s--- --------...].
         single = False if (blob[i] & 0b1000) >> 3 else True
-        if single:
-            return struct.unpack("f", blob[i + 2 : i + 2 + 4])[0]
-        else:
-            return struct.unpack("d", blob[i + 2 : i + 2 + 8])[0]
-    elif blob[i] < 0b1000000:
+        return struct.unpack_from("<f" if single else "<d", blob, i + 2)[0]
+    elif tag == 0b0011:
         # Special [0011ss-- --------].
         sign = (blob[i] & 0b1100) >> 2
-        if sign == 0:
-            return None
-        elif sign == 1:
+        if sign == 1:
             return False
         elif sign == 2:
             return True
+        return None
+    raise ValueError(f"unexpected Fleece value {blob[i]:#x} at {i}")
+
+
+def parseFleece(blob, shared=None, i=None):
+    i = derefFleece(blob, len(blob) - 2 if i is None else i)
+    if blob[i] < 0b1100000:
+        return parseFleeceScalar(blob, i)
+
+    # Decode collections with an explicit stack of [offset, value, wide, count, first,
+    # index, key] frames instead of recursion. Strings and collections are memoized by
+    # their offsets so shared keys and subtrees are only decoded once in a blob.
+    values = {}
+    stack = []
+    wide, count, first = parseFleeceCollection(blob, i)
+    frame = [i, {} if blob[i] >= 0b1110000 else [], wide, count, first, 0, None]
+    while True:
+        i, value, wide, count, first, j, key = frame
+        is_dict = type(value) == dict
+        width = 4 if wide else 2
+        step = 2 * width if is_dict else width
+        for k in range(first + step * j, first + step * count, step):
+            if is_dict:
+                if blob[k] < 0b10000:
+                    # Shared keys are stored as small integers.
+                    key = shared[((blob[k] & 0b1111) << 8) + blob[k + 1]]
+                else:
+                    l = derefFleece(blob, k, wide) if blob[k] & 0b10000000 else k
+                    if l not in values:
+                        values[l] = parseFleeceScalar(blob, l)
+                    key = values[l]
+                k = k + width
+
+            # Only values behind pointers could be shared. Inline values are scalars
+            # or empty collections.
+            descend = False
+            if blob[k] & 0b10000000:
+                k = derefFleece(blob, k, wide)
+                if k in values:
+                    element = values[k]
+                elif blob[k] < 0b1100000:
+                    element = values[k] = parseFleeceScalar(blob, k)
+                else:
+                    descend = True
+            elif blob[k] < 0b10000:
+                element = ((blob[k] & 0b1111) << 8) + blob[k + 1]
+                if element & 0b1000_00000000:
+                    element = element - 0b10000_00000000
+            elif blob[k] < 0b1100000:
+                element = parseFleeceScalar(blob, k)
+            else:
+                descend = True
+            if descend:
+                # Suspend the collection and descend into the nested one.
+                frame[5] = j
+                frame[6] = key
+                stack.append(frame)
+                wide, count, first = parseFleeceCollection(blob, k)
+                value = {} if blob[k] >= 0b1110000 else []
+                frame = [k, value, wide, count, first, 0, None]
+                break
+            if is_dict:
+                value[key] = element
+            else:
+                value.append(element)
+            j = j + 1
         else:
-            return None
-    elif blob[i] < 0b1010000:
-        # String [0100cccc ssssssss...].
-        count = blob[i] & 0b1111
-        if count == 0b1111:
-            varlen = 0
-            count = 0
-            while True:
-                end = False if (blob[i + 1 + varlen] & 0b10000000) >> 7 else True
-                count = count + ((blob[i + 1 + varlen] & 0b1111111) << 7 * varlen)
-                varlen = varlen + 1
-                if end:
-                    break
-            return blob[i + 1 + varlen : i + 1 + varlen + count].decode("utf-8")
-        else:
-            return blob[i + 1 : i + 1 + count].decode("utf-8")
-    elif blob[i] < 0b1100000:
-        # Binary data [0101cccc dddddddd...].
-        raise NotImplementedError()
+            values[i] = value
+            if not stack:
+                return value
+            frame = stack.pop()
+            if type(frame[1]) == dict:
+                frame[1][frame[6]] = value
+            else:
+                frame[1].append(value)
+            frame[5] = frame[5] + 1
+
+
+def loadFleece(blob, shared=None, i=None, w=False):
+    i = derefFleece(blob, len(blob) - 2 if i is None else i, w)
+    if blob[i] < 0b1100000:
+        return parseFleeceScalar(blob, i)
     elif blob[i] < 0b1110000:
-        # Array [0110wccc cccccccc...].
-        wide = True if (blob[i] & 0b1000) >> 3 else False
-        count = ((blob[i] & 0b111) << 8) + blob[i + 1]
-        if count == 0b111_11111111:
-            # Array with varint elements count.
-            raise NotImplementedError()
-        values = []
-        j = 0
-        while j < count:
-            values.append(
-                parseFleece(blob, shared, i + 2 + (4 if wide else 2) * j, wide)
+        return FleeceArray(blob, shared, i)
+    else:
+        return FleeceDict(blob, shared, i)
+
+
+# Lazy view of a Fleece array which only decodes elements when accessed.
+class FleeceArray(collections.abc.Sequence):
+    def __init__(self, blob, shared, i):
+        self.blob = blob
+        self.shared = shared
+        self.i = i
+        self.wide, self.count, self.first = parseFleeceCollection(blob, i)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if type(index) == slice:
+            return [self[j] for j in range(*index.indices(self.count))]
+        if index < 0:
+            index = index + self.count
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+        return loadFleece(
+            self.blob,
+            self.shared,
+            self.first + (4 if self.wide else 2) * index,
+            self.wide,
+        )
+
+    def to_python(self):
+        return parseFleece(self.blob, self.shared, self.i)
+
+
+# Lazy view of a Fleece dictionary which only decodes values when accessed.
+class FleeceDict(collections.abc.Mapping):
+    def __init__(self, blob, shared, i):
+        self.blob = blob
+        self.shared = shared
+        self.i = i
+        self.wide, self.count, self.first = parseFleeceCollection(blob, i)
+        self.slots = None
+
+    def index(self):
+        # Map keys to the offsets of their values, values are left undecoded.
+        if self.slots is None:
+            width = 4 if self.wide else 2
+            self.slots = {}
+            for k in range(self.first, self.first + 2 * width * self.count, 2 * width):
+                key = loadFleece(self.blob, self.shared, k, self.wide)
+                if type(key) == int:
+                    key = self.shared[key]
+                self.slots[key] = k + width
+        return self.slots
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.index())
+
+    def __getitem__(self, key):
+        return loadFleece(self.blob, self.shared, self.index()[key], self.wide)
+
+    def to_python(self):
+        return parseFleece(self.blob, self.shared, self.i)
+
+
+def read_shared(cur):
+    return parseFleece(
+        cur.execute("SELECT body FROM kv_info WHERE `key` = 'SharedKeys'").fetchone()[0]
+    )
+
+
+def read_results(path):
+    with sqlite3.connect(path, uri=True) as conn:
+        cur = conn.cursor()
+        shared = read_shared(cur)
+        for row in cur.execute("SELECT body FROM kv_default"):
+            yield loadFleece(row[0], shared)
+
+
+def read_blobs(path):
+    with sqlite3.connect(path, uri=True) as conn:
+        cur = conn.cursor()
+        for row in cur.execute("SELECT body FROM kv_default"):
+            yield row[0]
+
+
+SHARED = {}
+
+
+def init_worker(shared):
+    global SHARED
+    SHARED = shared
+
+
+def decode_results(task):
+    path, blobs = task
+    return [parseFleece(blob, SHARED[path]) for blob in blobs]
+
+
+def read_results_in_parallel(executor, path, chunk_size, window):
+    return utils.parallel_map(
+        executor,
+        decode_results,
+        ((path, c) for c in utils.chunk(read_blobs(path), chunk_size)),
+        window,
+    )
+
+
+def extract_database(archive, path, dir):
+    # Only extract the database instead of the whole archive. Databases without
+    # write-ahead logs are opened as immutable so SQLite skips locking and journaling.
+    names = set(archive.namelist())
+    archive.extract(f"{path}/db.sqlite3", dir)
+    for suffix in ["-wal", "-shm"]:
+        if f"{path}/db.sqlite3{suffix}" in names:
+            archive.extract(f"{path}/db.sqlite3{suffix}", dir)
+    uri = pathlib.Path(f"{dir}/{path}/db.sqlite3").absolute().as_uri()
+    if f"{path}/db.sqlite3-wal" in names:
+        return f"{uri}?mode=ro"
+    return f"{uri}?immutable=1"
+
+
+def convert(vs_path, coop_path, args, path, manifest=None):
+    ids = set()
+    if args.jobs > 1:
+        # Shared keys are sent once to each worker, and both databases are decoded
+        # in the same pool concurrently.
+        shared = {}
+        for p in [vs_path, coop_path]:
+            with sqlite3.connect(p, uri=True) as conn:
+                shared[p] = read_shared(conn.cursor())
+        with concurrent.futures.ProcessPoolExecutor(
+            args.jobs, initializer=init_worker, initargs=(shared,)
+        ) as executor:
+            battles = read_results_in_parallel(
+                executor, vs_path, args.chunk_size, 2 * args.jobs
             )
-            j = j + 1
-        return values
-    elif blob[i] < 0b10000000:
-        # Dictionary [0111wccc cccccccc...].
-        wide = True if (blob[i] & 0b1000) >> 3 else False
-        count = ((blob[i] & 0b111) << 8) + blob[i + 1]
-        if count == 0b111_11111111:
-            # Dictionary with varint elements count.
-            raise NotImplementedError()
-        values = {}
-        j = 0
-        while j < count:
-            key = parseFleece(blob, shared, i + 2 + (8 if wide else 4) * j, wide)
-            if type(key) == int:
-                key = shared[key]
-            values[key] = parseFleece(
-                blob, shared, i + 2 + (8 if wide else 4) * j + (4 if wide else 2), wide
+            coops = read_results_in_parallel(
+                executor, coop_path, args.chunk_size, 2 * args.jobs
             )
-            j = j + 1
-        return values
-    else:
-        # Pointer [1ooooooo oooooooo].
-        offset = 0
-        if w:
-            offset = 2 * (
-                ((blob[i] & 0b1111111) << 24)
-                + (blob[i + 1] << 16)
-                + (blob[i + 2] << 8)
-                + blob[i + 3]
+            if manifest is not None:
+                battles, coops = manifest.new(
+                    args.path, battles, coops, lambda x: x["id"]
+                )
+            battles = utils.pipe(
+                utils.unique(battles, lambda x: x["id"], ids),
+                lambda x: {"vsHistoryDetail": x},
             )
-        else:
-            offset = 2 * (((blob[i] & 0b1111111) << 8) + blob[i + 1])
-        return parseFleece(blob, shared, i - offset, True)
+            coops = utils.pipe(
+                utils.unique(coops, lambda x: x["id"], ids),
+                lambda x: {"coopHistoryDetail": x},
+            )
+            count = utils.write_out(path, battles, coops, args.compress_level, manifest)
+    else:
+        # Results are deduplicated by their IDs before being fully decoded.
+        battles = read_results(vs_path)
+        coops = read_results(coop_path)
+        if manifest is not None:
+            battles, coops = manifest.new(args.path, battles, coops, lambda x: x["id"])
+        battles = utils.pipe(
+            utils.unique(battles, lambda x: x["id"], ids),
+            lambda x: {"vsHistoryDetail": x.to_python()},
+        )
+        coops = utils.pipe(
+            utils.unique(coops, lambda x: x["id"], ids),
+            lambda x: {"coopHistoryDetail": x.to_python()},
+        )
+        count = utils.write_out(path, battles, coops, args.compress_level, manifest)
+    return count
 
 
 def main():
@@ -125,42 +339,26 @@ def main():
             f'Please specify the IKAX3 database with "python3 {sys.argv[0]} <PATH_TO_IKAX3>".'
         )
         return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    utils.add_output_arguments(argument_parser)
+    utils.add_jobs_arguments(argument_parser)
+    args = argument_parser.parse_args()
 
-    dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(sys.argv[1], "r") as f:
-        f.extractall(dir)
-    id = ""
-    with open(f"{dir}/account.json", "r", encoding="utf-8") as f:
-        id = json.load(f)["id"]
-
-    count = 0
-    battles = []
-    coops = []
-    with sqlite3.connect(f"{dir}/{id}/vsResult.cblite2/db.sqlite3") as conn:
-        cur = conn.cursor()
-        shared = parseFleece(
-            cur.execute(
-                "SELECT body FROM kv_info WHERE `key` = 'SharedKeys'"
-            ).fetchone()[0]
-        )
-        for row in cur.execute("SELECT body FROM kv_default"):
-            battle = parseFleece(row[0], shared)
-            battles.append({"vsHistoryDetail": battle})
-            count = count + 1
-    with sqlite3.connect(f"{dir}/{id}/coopResult.cblite2/db.sqlite3") as conn:
-        cur = conn.cursor()
-        shared = parseFleece(
-            cur.execute(
-                "SELECT body FROM kv_info WHERE `key` = 'SharedKeys'"
-            ).fetchone()[0]
-        )
-        for row in cur.execute("SELECT body FROM kv_default"):
-            coop = parseFleece(row[0], shared)
-            coops.append({"coopHistoryDetail": coop})
-            count = count + 1
+    manifest = utils.load_manifest(args)
 
-    utils.write_out("conch-bay-import", battles, coops)
-    print(f'Export {count} results to "conch-bay-import.zip".')
+    path = utils.output_path("conch-bay-import", manifest)
+    if manifest is not None and not manifest.changed(args.path):
+        # Unchanged archives are not extracted again.
+        count = utils.write_out(path, [], [], args.compress_level, manifest)
+    else:
+        with tempfile.TemporaryDirectory() as dir:
+            with zipfile.ZipFile(args.path, "r") as f:
+                id = utils.loads(f.read("account.json"))["id"]
+                vs_path = extract_database(f, f"{id}/vsResult.cblite2", dir)
+                coop_path = extract_database(f, f"{id}/coopResult.cblite2", dir)
+            count = convert(vs_path, coop_path, args, path, manifest)
+    utils.print_export(count, path, manifest)
 
 
 if __name__ == "__main__":
@@ -1,60 +1,121 @@
-import json
+import argparse
+import concurrent.futures
+import contextlib
 import os
 import sys
+import time
 import utils
 
 
+def list_files(path, since=0):
+    if os.path.exists(path):
+        for file in os.listdir(path):
+            if os.path.getmtime(f"{path}/{file}") >= since:
+                yield f"{path}/{file}"
+
+
+def skip_seen(paths, key, seen):
+    # Skip files of results seen before by scanning their IDs without decoding them.
+    for path in paths:
+        with open(path, "rb") as f:
+            id = utils.scan_id(f, "data", key)
+        if id is None or not any(id in ids for ids in seen):
+            yield path
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return utils.loads(f.read())
+
+
+def read_file_chunk(paths):
+    return [read_file(path) for path in paths]
+
+
+def read_files(paths, executor=None, chunk_size=256, window=1):
+    if executor is None:
+        for path in paths:
+            yield read_file(path)
+    else:
+        yield from utils.parallel_map(
+            executor, read_file_chunk, utils.chunk(paths, chunk_size), window
+        )
+
+
+def read_bundles(path, name, since=0):
+    for dir in os.listdir(path):
+        if (
+            dir.startswith("export-")
+            and os.path.getmtime(f"{path}/{dir}/{name}") >= since
+        ):
+            with open(f"{path}/{dir}/{name}", "rb") as f:
+                yield from utils.read_array(f)
+
+
 def main():
     if len(sys.argv) <= 1:
         print(
             f'Please specify the directory of s3s with "python3 {sys.argv[0]} <PATH>".'
         )
         return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    argument_parser.add_argument(
+        "--skip-seen",
+        action="store_true",
+        help="scan IDs of files first to skip results seen before without decoding",
+    )
+    utils.add_output_arguments(argument_parser)
+    utils.add_jobs_arguments(argument_parser)
+    args = argument_parser.parse_args()
+
+    manifest = utils.load_manifest(args)
+
+    # Only files modified since the previous incremental run are read.
+    since = 0
+    if manifest is not None:
+        since = manifest.source(args.path).get("watermark", 0)
+        watermark = time.time()
 
     ids = set()
-    battles = []
-    coops = []
-    if os.path.exists(f"{sys.argv[1]}/exports/results"):
-        for file in os.listdir(f"{sys.argv[1]}/exports/results"):
-            with open(f"{sys.argv[1]}/exports/results/{file}", encoding="utf-8") as f:
-                datum = json.loads(f.read())
-                battle = datum["data"]
-                id = battle["vsHistoryDetail"]["id"]
-                if id not in ids:
-                    ids.add(id)
-                    battles.append(battle)
-    if os.path.exists(f"{sys.argv[1]}/exports/coop_results"):
-        for file in os.listdir(f"{sys.argv[1]}/exports/coop_results"):
-            with open(
-                f"{sys.argv[1]}/exports/coop_results/{file}", encoding="utf-8"
-            ) as f:
-                datum = json.loads(f.read())
-                coop = datum["data"]
-                id = coop["coopHistoryDetail"]["id"]
-                if id not in ids:
-                    ids.add(id)
-                    coops.append(coop)
-    for dir in os.listdir(sys.argv[1]):
-        if dir.startswith("export-"):
-            with open(f"{sys.argv[1]}/{dir}/results.json", encoding="utf-8") as f:
-                data = json.loads(f.read())
-                for datum in data:
-                    battle = datum["data"]
-                    id = battle["vsHistoryDetail"]["id"]
-                    if id not in ids:
-                        ids.add(id)
-                        battles.append(battle)
-            with open(f"{sys.argv[1]}/{dir}/coop_results.json", encoding="utf-8") as f:
-                data = json.loads(f.read())
-                for datum in data:
-                    coop = datum["data"]
-                    id = coop["coopHistoryDetail"]["id"]
-                    if id not in ids:
-                        ids.add(id)
-                        coops.append(coop)
-
-    utils.write_out("conch-bay-import", battles, coops)
-    print(f'Export {len(ids)} results to "conch-bay-import.zip".')
+    seen = [ids] if manifest is None else [ids, manifest.ids]
+
+    def read_results(dir, name, key, executor):
+        paths = list_files(f"{args.path}/exports/{dir}", since)
+        if args.skip_seen:
+            paths = skip_seen(paths, key, seen)
+        yield from read_files(paths, executor, args.chunk_size, 2 * args.jobs)
+        yield from read_bundles(args.path, name, since)
+
+    with (
+        concurrent.futures.ProcessPoolExecutor(args.jobs)
+        if args.jobs > 1
+        else contextlib.nullcontext()
+    ) as executor:
+        battles = utils.unique(
+            utils.pipe(
+                read_results("results", "results.json", "vsHistoryDetail", executor),
+                lambda x: x["data"],
+            ),
+            lambda x: x["vsHistoryDetail"]["id"],
+            ids,
+        )
+        coops = utils.unique(
+            utils.pipe(
+                read_results(
+                    "coop_results", "coop_results.json", "coopHistoryDetail", executor
+                ),
+                lambda x: x["data"],
+            ),
+            lambda x: x["coopHistoryDetail"]["id"],
+            ids,
+        )
+        if manifest is not None:
+            coops = manifest.track(coops, args.path, watermark=watermark)
+
+        path = utils.output_path("conch-bay-import", manifest)
+        count = utils.write_out(path, battles, coops, args.compress_level, manifest)
+    utils.print_export(count, path, manifest)
 
 
 if __name__ == "__main__":
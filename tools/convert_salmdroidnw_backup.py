@@ -1,7 +1,6 @@
 from hashlib import sha256
-import json
+import argparse
 import os
-import requests
 import sys
 import tempfile
 import utils
@@ -43,67 +42,79 @@ def format_member_result(member_result):
             decorate_image_obj(member_result["specialWeapon"], "special_img/blue")
 
 
-def warmup():
-    global GRIZZCO_WEAPON_IMAGE
-    version = requests.get(
-        "https://raw.githubusercontent.com/Leanny/splat3/main/data/mush/latest"
-    ).text
-    weapons = requests.get(
-        f"https://raw.githubusercontent.com/Leanny/splat3/main/data/mush/{version}/WeaponInfoMain.json"
-    ).json()
+def build_maps(resources):
+    weapons = resources.fetch("WeaponInfoMain")
     coop_weapons = [
         sha256(weapon["__RowId"].encode("utf-8")).hexdigest()
         for weapon in weapons
         if weapon["IsCoopRare"]
     ]
-    GRIZZCO_WEAPON_IMAGE = [f"{weapon}_0.png" for weapon in coop_weapons]
+    return [f"{weapon}_0.png" for weapon in coop_weapons]
 
 
-def main():
-    if len(sys.argv) <= 1:
-        print(
-            f'Please specify the salmdroidNW backup with "python3 {sys.argv[0]} <PATH>".'
-        )
-        return
-    warmup()
+def warmup(resources):
+    global GRIZZCO_WEAPON_IMAGE
+    GRIZZCO_WEAPON_IMAGE = resources.cache("salmdroidNW", lambda: build_maps(resources))
 
-    dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(sys.argv[1], "r") as f:
-        f.extractall(dir)
 
-    coops = []
+def read_results(dir):
     n = 1
     while os.path.exists(f"{dir}/{n}"):
-        with open(f"{dir}/{n}", encoding="utf-8") as f:
-            data = json.loads(f.read())
-            results = json.loads(data["results"])
-            for result in results:
-                obj = json.loads(result["coopHistory"])
-
-                format_member_result(obj["myResult"])
-                for member_result in obj["memberResults"]:
-                    format_member_result(member_result)
-                if obj["bossResult"] != None:
-                    decorate_image_obj(obj["bossResult"]["boss"], "coop_enemy_img")
-                for enemy_result in obj["enemyResults"]:
-                    decorate_image_obj(enemy_result["enemy"], "coop_enemy_img")
-                for wave_result in obj["waveResults"]:
-                    for special_weapon in wave_result["specialWeapons"]:
-                        decorate_image_obj(special_weapon, "special_img/blue")
-                decorate_image_obj(
-                    obj["coopStage"], "stage_img/banner/high_resolution", False
-                )
-                for weapon in obj["weapons"]:
-                    if weapon["image"]["url"] in RANDOM_IMAGE:
-                        decorate_image_obj(weapon, "ui_img", True)
-                    else:
-                        decorate_image_obj(weapon, "weapon_illust", True)
-
-                coops.append({"coopHistoryDetail": obj})
+        with open(f"{dir}/{n}", "rb") as f:
+            data = utils.loads(f.read())
+            for result in utils.loads(data["results"]):
+                yield utils.loads(result["coopHistory"])
         n += 1
 
-    utils.write_out("conch-bay-import", [], coops)
-    print(f'Export {len(coops)} coops to "conch-bay-import.zip".')
+
+def format_coop(obj):
+    format_member_result(obj["myResult"])
+    for member_result in obj["memberResults"]:
+        format_member_result(member_result)
+    if obj["bossResult"] != None:
+        decorate_image_obj(obj["bossResult"]["boss"], "coop_enemy_img")
+    for enemy_result in obj["enemyResults"]:
+        decorate_image_obj(enemy_result["enemy"], "coop_enemy_img")
+    for wave_result in obj["waveResults"]:
+        for special_weapon in wave_result["specialWeapons"]:
+            decorate_image_obj(special_weapon, "special_img/blue")
+    decorate_image_obj(obj["coopStage"], "stage_img/banner/high_resolution", False)
+    for weapon in obj["weapons"]:
+        if weapon["image"]["url"] in RANDOM_IMAGE:
+            decorate_image_obj(weapon, "ui_img", True)
+        else:
+            decorate_image_obj(weapon, "weapon_illust", True)
+    return {"coopHistoryDetail": obj}
+
+
+def main():
+    if len(sys.argv) <= 1:
+        print(
+            f'Please specify the salmdroidNW backup with "python3 {sys.argv[0]} <PATH>".'
+        )
+        return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    utils.add_output_arguments(argument_parser)
+    utils.add_resource_arguments(argument_parser)
+    args = argument_parser.parse_args()
+    warmup(utils.load_resources(args))
+    manifest = utils.load_manifest(args)
+
+    path = utils.output_path("conch-bay-import", manifest)
+    if manifest is not None and not manifest.changed(args.path):
+        # Unchanged archives are not extracted again.
+        count = utils.write_out(path, [], [], args.compress_level, manifest)
+    else:
+        with tempfile.TemporaryDirectory() as dir:
+            with zipfile.ZipFile(args.path, "r") as f:
+                f.extractall(dir)
+
+            coops = utils.pipe(read_results(dir), format_coop)
+            if manifest is not None:
+                coops = manifest.track(coops, args.path)
+            count = utils.write_out(path, [], coops, args.compress_level, manifest)
+    utils.print_export(count, path, manifest, "coops")
 
 
 if __name__ == "__main__":
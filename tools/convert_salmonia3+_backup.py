@@ -1,11 +1,10 @@
 from base64 import b64encode
+from datetime import datetime
 from dateutil import parser
 from hashlib import sha256
-import json
-import os
-import requests
+import argparse
+import functools
 import sys
-import tempfile
 import utils
 import zipfile
 
@@ -44,13 +43,25 @@ ENEMY_IMAGE = {
 COOP_STAGE_IMAGE = {}
 
 
+@functools.lru_cache(maxsize=256)
+def format_time(play_time):
+    # IDs of a result and its players share the time, which is usually in ISO 8601
+    # and parsed without dateutil.
+    try:
+        time = datetime.fromisoformat(play_time.replace("Z", "+00:00"))
+    except ValueError:
+        time = parser.parse(play_time)
+    return time.strftime("%Y%m%dT%H%M%S")
+
+
 def construct_id(path, npln_user_id, play_time, uuid, suffix=""):
-    time = parser.parse(play_time).strftime("%Y%m%dT%H%M%S")
+    time = format_time(play_time)
     return b64encode(
         f"{path}-u-{npln_user_id}:{time}_{uuid.lower()}{suffix}".encode("utf-8")
     ).decode("utf-8")
 
 
+@utils.shared
 def construct_obj(path, id, with_name=True):
     formatted_id = f"{path}-{id}".encode("utf-8")
     if with_name:
@@ -59,36 +70,39 @@ def construct_obj(path, id, with_name=True):
         return {"id": b64encode(formatted_id).decode("utf-8")}
 
 
+@utils.shared
 def construct_image_obj(path, id, url, with_name=True):
-    obj = construct_obj(path, id, with_name)
-    obj["image"] = {"url": url}
-    return obj
+    return {**construct_obj(path, id, with_name), "image": {"url": url}}
 
 
+@utils.shared
 def construct_weapon(url):
     return {"name": "", "image": {"url": url}}
 
 
 def construct_member_result(result, player):
-    background = construct_image_obj(
-        "NameplateBackground",
-        player["background"],
-        BACKGROUND_IMAGE[player["background"]],
-        False,
-    )
-    background["textColor"] = {
-        "a": float(player["textColor"][3]),
-        "b": float(player["textColor"][2]),
-        "g": float(player["textColor"][1]),
-        "r": float(player["textColor"][0]),
+    background = {
+        **construct_image_obj(
+            "NameplateBackground",
+            player["background"],
+            BACKGROUND_IMAGE[player["background"]],
+            False,
+        ),
+        "textColor": {
+            "a": float(player["textColor"][3]),
+            "b": float(player["textColor"][2]),
+            "g": float(player["textColor"][1]),
+            "r": float(player["textColor"][0]),
+        },
     }
     special_weapon = (
-        construct_weapon(SPECIAL_WEAPON_IMAGE[player["specialId"]])
+        {
+            **construct_weapon(SPECIAL_WEAPON_IMAGE[player["specialId"]]),
+            "weaponId": player["specialId"],
+        }
         if player["specialId"] != None
         else None
     )
-    if special_weapon != None:
-        special_weapon["weaponId"] = player["specialId"]
     return {
         "player": {
             "__isPlayer": "CoopPlayer",
@@ -150,35 +164,32 @@ def format_map(map, obj, path, is_splatoon3_ink=False, name_decorator=lambda x:
     )
 
 
-def fetch_resource(version, path):
-    return requests.get(
-        f"https://raw.githubusercontent.com/Leanny/splat3/main/data/mush/{version}/{path}.json"
-    ).json()
-
-
-def warmup():
-    global BACKGROUND_IMAGE, BADGE_IMAGE, UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE
-    version = requests.get(
-        "https://raw.githubusercontent.com/Leanny/splat3/main/data/mush/latest"
-    ).text
+def build_maps(resources):
+    backgrounds, badges, uniforms, weapons, special_weapons, coop_stages = (
+        resources.fetch_all(
+            [
+                "NamePlateBgInfo",
+                "BadgeInfo",
+                "CoopSkinInfo",
+                "WeaponInfoMain",
+                "WeaponInfoSpecial",
+                "CoopSceneInfo",
+            ]
+        )
+    )
 
-    backgrounds = fetch_resource(version, "NamePlateBgInfo")
     for background in backgrounds:
         format_map(BACKGROUND_IMAGE, background, "npl_img")
 
-    badges = fetch_resource(version, "BadgeInfo")
     for badge in badges:
         BADGE_IMAGE[badge["Id"]] = format_image("badge_img", badge["Name"])
 
-    uniforms = fetch_resource(version, "CoopSkinInfo")
     for uniform in uniforms:
         format_map(UNIFORM_IMAGE, uniform, "coop_skin_img")
 
-    weapons = fetch_resource(version, "WeaponInfoMain")
     for weapon in weapons:
         format_map(WEAPON_IMAGE, weapon, "weapon_illust", not weapon["IsCoopRare"])
 
-    special_weapons = fetch_resource(version, "WeaponInfoSpecial")
     for special_weapon in special_weapons:
         format_map(
             SPECIAL_WEAPON_IMAGE,
@@ -187,12 +198,163 @@ def warmup():
             name_decorator=lambda x: x.replace("_Coop", ""),
         )
 
-    coop_stages = fetch_resource(version, "CoopSceneInfo")
     for coop_stage in coop_stages:
         format_map(
             COOP_STAGE_IMAGE, coop_stage, "stage_img/banner/high_resolution", False
         )
 
+    return (
+        BACKGROUND_IMAGE,
+        BADGE_IMAGE,
+        UNIFORM_IMAGE,
+        WEAPON_IMAGE,
+        SPECIAL_WEAPON_IMAGE,
+        COOP_STAGE_IMAGE,
+    )
+
+
+def warmup(resources):
+    global BACKGROUND_IMAGE, BADGE_IMAGE, UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE
+    (
+        BACKGROUND_IMAGE,
+        BADGE_IMAGE,
+        UNIFORM_IMAGE,
+        WEAPON_IMAGE,
+        SPECIAL_WEAPON_IMAGE,
+        COOP_STAGE_IMAGE,
+    ) = resources.cache("salmonia3+", lambda: build_maps(resources))
+
+
+def read_results(path):
+    # Schedules are decoded one at a time from the backup in the ZIP, which could be
+    # too large to be decoded at once.
+    with zipfile.ZipFile(path, "r") as z:
+        name = next(x for x in z.namelist() if not x.endswith("/"))
+        with z.open(name) as f:
+            for schedule in utils.read_array(f, "schedules"):
+                for result in schedule["results"]:
+                    yield schedule, result
+
+
+def convert_result(schedule, result):
+    enemyResults = []
+    for i in range(0, 14):
+        if result["bossCounts"][i] != 0:
+            enemyResults.append(
+                {
+                    "defeatCount": result["players"][0]["bossKillCounts"][i],
+                    "teamDefeatCount": result["bossKillCounts"][i],
+                    "popCount": result["bossCounts"][i],
+                    "enemy": construct_image_obj(
+                        "CoopEnemy", ENEMY_MAP[i], ENEMY_IMAGE[ENEMY_MAP[i]]
+                    ),
+                }
+            )
+    specialWeapons = []
+    for i in range(0, len(result["waves"])):
+        specialWeapon = []
+        for player in result["players"]:
+            for _ in range(0, player["specialCounts"][i]):
+                specialWeapon.append(
+                    construct_image_obj(
+                        "SpecialWeapon",
+                        player["specialId"],
+                        SPECIAL_WEAPON_IMAGE[player["specialId"]],
+                    )
+                )
+            specialWeapons.append(specialWeapon)
+    return {
+        "coopHistoryDetail": {
+            "__typename": "CoopHistoryDetail",
+            "id": construct_id(
+                "CoopHistoryDetail",
+                result["nplnUserId"],
+                result["playTime"],
+                result["uuid"],
+            ),
+            "afterGrade": (
+                construct_obj("CoopGrade", result["gradeId"])
+                if result["gradeId"] != None
+                else None
+            ),
+            "myResult": construct_member_result(result, result["players"][0]),
+            "memberResults": list(
+                map(
+                    lambda x: construct_member_result(result, x),
+                    result["players"][1:],
+                )
+            ),
+            "bossResult": (
+                {
+                    "boss": construct_image_obj(
+                        "CoopEnemy",
+                        result["bossId"],
+                        ENEMY_IMAGE[result["bossId"]],
+                    ),
+                    "hasDefeatBoss": result["isBossDefeated"],
+                }
+                if result["bossId"] != None
+                else None
+            ),
+            "enemyResults": enemyResults,
+            "waveResults": list(
+                map(
+                    lambda x: {
+                        "waveNumber": x["waveId"],
+                        "waterLevel": x["waterLevel"],
+                        "eventWave": (
+                            construct_obj("CoopEventWave", x["eventType"])
+                            if x["eventType"] != 0
+                            else None
+                        ),
+                        "deliverNorm": x["quotaNum"],
+                        "goldenPopCount": x["goldenIkuraPopNum"],
+                        "teamDeliverCount": x["goldenIkuraNum"],
+                        "specialWeapons": specialWeapons[x["waveId"] - 1],
+                    },
+                    result["waves"],
+                )
+            ),
+            "resultWave": (
+                result["failureWave"] if result["failureWave"] != None else 0
+            ),
+            "playedTime": result["playTime"],
+            "rule": schedule["rule"],
+            "coopStage": construct_image_obj(
+                "CoopStage",
+                schedule["stageId"],
+                COOP_STAGE_IMAGE[schedule["stageId"]],
+            ),
+            "dangerRate": float(result["dangerRate"]),
+            "scenarioCode": result["scenarioCode"],
+            "smellMeter": result["smellMeter"],
+            "weapons": list(
+                map(
+                    lambda x: construct_weapon(WEAPON_IMAGE[x]),
+                    schedule["weaponList"],
+                )
+            ),
+            "afterGradePoint": result["gradePoint"],
+            "scale": (
+                {
+                    "gold": result["scale"][2],
+                    "silver": result["scale"][1],
+                    "bronze": result["scale"][0],
+                }
+                if result["scale"][0] != None
+                else None
+            ),
+            "jobPoint": result["kumaPoint"],
+            "jobScore": result["jobScore"],
+            "jobRate": (
+                float(result["jobRate"]) if result["jobRate"] != None else None
+            ),
+            "jobBonus": result["jobBonus"],
+            "nextHistoryDetail": None,
+            "previousHistoryDetail": None,
+        }
+    }
+
 
 def main():
     if len(sys.argv) <= 1:
@@ -200,151 +362,21 @@ def main():
             f'Please specify the Salmonia3+ backup with "python3 {sys.argv[0]} <PATH>".'
         )
         return
-    warmup()
-
-    dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(sys.argv[1], "r") as f:
-        f.extractall(dir)
-
-    coops = []
-    with open(f"{dir}/{os.listdir(dir)[0]}", encoding="utf-8") as f:
-        data = json.loads(f.read())
-        for schedule in data["schedules"]:
-            for result in schedule["results"]:
-                enemyResults = []
-                for i in range(0, 14):
-                    if result["bossCounts"][i] != 0:
-                        enemyResults.append(
-                            {
-                                "defeatCount": result["players"][0]["bossKillCounts"][
-                                    i
-                                ],
-                                "teamDefeatCount": result["bossKillCounts"][i],
-                                "popCount": result["bossCounts"][i],
-                                "enemy": construct_image_obj(
-                                    "CoopEnemy", ENEMY_MAP[i], ENEMY_IMAGE[ENEMY_MAP[i]]
-                                ),
-                            }
-                        )
-                specialWeapons = []
-                for i in range(0, len(result["waves"])):
-                    specialWeapon = []
-                    for player in result["players"]:
-                        for _ in range(0, player["specialCounts"][i]):
-                            specialWeapon.append(
-                                construct_image_obj(
-                                    "SpecialWeapon",
-                                    player["specialId"],
-                                    SPECIAL_WEAPON_IMAGE[player["specialId"]],
-                                )
-                            )
-                        specialWeapons.append(specialWeapon)
-                coops.append(
-                    {
-                        "coopHistoryDetail": {
-                            "__typename": "CoopHistoryDetail",
-                            "id": construct_id(
-                                "CoopHistoryDetail",
-                                result["nplnUserId"],
-                                result["playTime"],
-                                result["uuid"],
-                            ),
-                            "afterGrade": (
-                                construct_obj("CoopGrade", result["gradeId"])
-                                if result["gradeId"] != None
-                                else None
-                            ),
-                            "myResult": construct_member_result(
-                                result, result["players"][0]
-                            ),
-                            "memberResults": list(
-                                map(
-                                    lambda x: construct_member_result(result, x),
-                                    result["players"][1:],
-                                )
-                            ),
-                            "bossResult": (
-                                {
-                                    "boss": construct_image_obj(
-                                        "CoopEnemy",
-                                        result["bossId"],
-                                        ENEMY_IMAGE[result["bossId"]],
-                                    ),
-                                    "hasDefeatBoss": result["isBossDefeated"],
-                                }
-                                if result["bossId"] != None
-                                else None
-                            ),
-                            "enemyResults": enemyResults,
-                            "waveResults": list(
-                                map(
-                                    lambda x: {
-                                        "waveNumber": x["waveId"],
-                                        "waterLevel": x["waterLevel"],
-                                        "eventWave": (
-                                            construct_obj(
-                                                "CoopEventWave", x["eventType"]
-                                            )
-                                            if x["eventType"] != 0
-                                            else None
-                                        ),
-                                        "deliverNorm": x["quotaNum"],
-                                        "goldenPopCount": x["goldenIkuraPopNum"],
-                                        "teamDeliverCount": x["goldenIkuraNum"],
-                                        "specialWeapons": specialWeapons[
-                                            x["waveId"] - 1
-                                        ],
-                                    },
-                                    result["waves"],
-                                )
-                            ),
-                            "resultWave": (
-                                result["failureWave"]
-                                if result["failureWave"] != None
-                                else 0
-                            ),
-                            "playedTime": result["playTime"],
-                            "rule": schedule["rule"],
-                            "coopStage": construct_image_obj(
-                                "CoopStage",
-                                schedule["stageId"],
-                                COOP_STAGE_IMAGE[schedule["stageId"]],
-                            ),
-                            "dangerRate": float(result["dangerRate"]),
-                            "scenarioCode": result["scenarioCode"],
-                            "smellMeter": result["smellMeter"],
-                            "weapons": list(
-                                map(
-                                    lambda x: construct_weapon(WEAPON_IMAGE[x]),
-                                    schedule["weaponList"],
-                                )
-                            ),
-                            "afterGradePoint": result["gradePoint"],
-                            "scale": (
-                                {
-                                    "gold": result["scale"][2],
-                                    "silver": result["scale"][1],
-                                    "bronze": result["scale"][0],
-                                }
-                                if result["scale"][0] != None
-                                else None
-                            ),
-                            "jobPoint": result["kumaPoint"],
-                            "jobScore": result["jobScore"],
-                            "jobRate": (
-                                float(result["jobRate"])
-                                if result["jobRate"] != None
-                                else None
-                            ),
-                            "jobBonus": result["jobBonus"],
-                            "nextHistoryDetail": None,
-                            "previousHistoryDetail": None,
-                        }
-                    }
-                )
-
-    utils.write_out("conch-bay-import", [], coops)
-    print(f'Export {len(coops)} coops to "conch-bay-import.zip".')
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    utils.add_output_arguments(argument_parser)
+    utils.add_resource_arguments(argument_parser)
+    args = argument_parser.parse_args()
+    warmup(utils.load_resources(args))
+    manifest = utils.load_manifest(args)
+
+    coops = utils.pipe(read_results(args.path), lambda x: convert_result(*x))
+    if manifest is not None:
+        _, coops = manifest.new(args.path, [], coops)
+
+    path = utils.output_path("conch-bay-import", manifest)
+    count = utils.write_out(path, [], coops, args.compress_level, manifest)
+    utils.print_export(count, path, manifest, "coops")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,12 @@
 from base64 import b64encode
 from datetime import datetime
 from hashlib import sha256
-import json
-import requests
+import argparse
+import concurrent.futures
+import contextlib
+import functools
+import mmap
+import os
 import sys
 import utils
 import uuid
@@ -73,13 +77,14 @@ def get_id_in_aliases(obj):
     return m
 
 
+@functools.lru_cache(maxsize=4096)
 def generate_dummy_npln_user_id(name, number):
+    # The same players appear in many results, so their IDs are cached.
     id = uuid.uuid5(uuid.NAMESPACE_OID, f"{name}#{number}")
     user_int = id.int % pow(36, 10)
     user_id = ""
     for _ in range(10):
-        digit = user_int % 36
-        user_int = int(user_int / 36)
+        user_int, digit = divmod(user_int, 36)
         if digit >= 10:
             user_id = chr(ord("a") + digit - 10) + user_id
         else:
@@ -87,13 +92,20 @@ def generate_dummy_npln_user_id(name, number):
     return user_id
 
 
+@functools.lru_cache(maxsize=256)
+def format_time(play_time):
+    # IDs of a result and its players share the time, which is formatted once.
+    return datetime.fromtimestamp(play_time).strftime("%Y%m%dT%H%M%S")
+
+
 def construct_id(path, npln_user_id, play_time, uuid, suffix=""):
-    time = datetime.fromtimestamp(play_time).strftime("%Y%m%dT%H%M%S")
+    time = format_time(play_time)
     return b64encode(
         f"{path}-u-{npln_user_id}:{time}_{uuid.lower()}{suffix}".encode("utf-8")
     ).decode("utf-8")
 
 
+@utils.shared
 def construct_obj(path, id, with_name=True):
     formatted_id = f"{path}-{id}".encode("utf-8")
     if with_name:
@@ -102,38 +114,41 @@ def construct_obj(path, id, with_name=True):
         return {"id": b64encode(formatted_id).decode("utf-8")}
 
 
+@utils.shared
 def construct_image_obj(path, id, url, with_name=True):
-    obj = construct_obj(path, id, with_name)
-    obj["image"] = {"url": url}
-    return obj
+    return {**construct_obj(path, id, with_name), "image": {"url": url}}
 
 
+@utils.shared
 def construct_weapon(url):
     return {"name": "", "image": {"url": url}}
 
 
 def construct_member_result(result, player):
-    background = construct_image_obj(
-        "NameplateBackground",
-        -1,
-        "",
-        False,
-    )
-    background["textColor"] = {
-        "a": 1,
-        "b": 0.67,
-        "g": 0.63,
-        "r": 0.63,
+    background = {
+        **construct_image_obj(
+            "NameplateBackground",
+            -1,
+            "",
+            False,
+        ),
+        "textColor": {
+            "a": 1,
+            "b": 0.67,
+            "g": 0.63,
+            "r": 0.63,
+        },
     }
     special_weapon = (
-        construct_weapon(
-            SPECIAL_WEAPON_IMAGE[SPECIAL_WEAPON_MAP[player["special"]["key"]]]
-        )
+        {
+            **construct_weapon(
+                SPECIAL_WEAPON_IMAGE[SPECIAL_WEAPON_MAP[player["special"]["key"]]]
+            ),
+            "weaponId": SPECIAL_WEAPON_MAP[player["special"]["key"]],
+        }
         if player["special"] != None
         else None
     )
-    if special_weapon != None:
-        special_weapon["weaponId"] = SPECIAL_WEAPON_MAP[player["special"]["key"]]
     user_id = generate_dummy_npln_user_id(player["name"], player["number"])
     return {
         "player": {
@@ -195,27 +210,17 @@ def format_map(map, obj, path, is_splatoon3_ink=False, name_decorator=lambda x:
     )
 
 
-def fetch_resource(version, path):
-    return requests.get(
-        f"https://raw.githubusercontent.com/Leanny/splat3/main/data/mush/{version}/{path}.json"
-    ).json()
-
-
-def warmup():
-    global UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE
-    version = requests.get(
-        "https://raw.githubusercontent.com/Leanny/splat3/main/data/mush/latest"
-    ).text
+def build_maps(resources):
+    uniforms, weapons, special_weapons, coop_stages = resources.fetch_all(
+        ["CoopSkinInfo", "WeaponInfoMain", "WeaponInfoSpecial", "CoopSceneInfo"]
+    )
 
-    uniforms = fetch_resource(version, "CoopSkinInfo")
     for uniform in uniforms:
         format_map(UNIFORM_IMAGE, uniform, "coop_skin_img")
 
-    weapons = fetch_resource(version, "WeaponInfoMain")
     for weapon in weapons:
         format_map(WEAPON_IMAGE, weapon, "weapon_illust", not weapon["IsCoopRare"])
 
-    special_weapons = fetch_resource(version, "WeaponInfoSpecial")
     for special_weapon in special_weapons:
         format_map(
             SPECIAL_WEAPON_IMAGE,
@@ -224,183 +229,274 @@ def warmup():
             name_decorator=lambda x: x.replace("_Coop", ""),
         )
 
-    coop_stages = fetch_resource(version, "CoopSceneInfo")
     for coop_stage in coop_stages:
         format_map(
             COOP_STAGE_IMAGE, coop_stage, "stage_img/banner/high_resolution", False
         )
 
+    return UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE
 
-def main():
-    if len(sys.argv) <= 1:
-        print(
-            f'Please specify the stat.ink Salmon Run JSON with "python3 {sys.argv[0]} <PATH>".'
-        )
-        return
-    warmup()
 
-    coops = []
-    with open(f"{sys.argv[1]}", encoding="utf-8") as f:
+def warmup(resources):
+    global UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE
+    UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE = (
+        resources.cache("stat.ink", lambda: build_maps(resources))
+    )
+
+
+def read_offset(path, manifest=None):
+    # Incremental runs continue from where the previous run stopped reading, unless
+    # the file was truncated.
+    if manifest is not None:
+        offset = manifest.source(path).get("offset", 0)
+        if os.path.getsize(path) >= offset:
+            return offset
+    return 0
+
+
+def read_results(path, manifest=None):
+    with open(path, "rb") as f:
+        f.seek(read_offset(path, manifest))
         while data := f.readline():
-            result = json.loads(data)
-            specialWeapons = []
-            for i in range(0, len(result["waves"])):
-                specialWeapon = []
-                if type(result["waves"][i]["special_uses"]) is dict:
-                    for use in result["waves"][i]["special_uses"].values():
-                        for _ in range(0, use["count"]):
-                            specialWeapon.append(
-                                construct_image_obj(
-                                    "SpecialWeapon",
-                                    SPECIAL_WEAPON_MAP[use["special"]["key"]],
-                                    SPECIAL_WEAPON_IMAGE[
-                                        SPECIAL_WEAPON_MAP[use["special"]["key"]]
-                                    ],
-                                )
-                            )
-                specialWeapons.append(specialWeapon)
+            yield utils.loads(data)
+        if manifest is not None:
+            manifest.record(path, offset=f.tell())
+
+
+def split_lines(m, start, size):
+    # Split the map into ranges of at most size lines, which end after newlines.
+    while start < len(m):
+        end = start
+        for _ in range(size):
+            end = m.find(b"\n", end) + 1
+            if end == 0:
+                end = len(m)
+                break
+        yield start, end
+        start = end
+
+
+MAP = None
+
+
+def init_worker(path, maps):
+    # Resource maps are sent once to each worker, which maps the file itself.
+    global MAP, UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE
+    UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE = maps
+    with open(path, "rb") as f:
+        MAP = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def convert_range(range):
+    start, end = range
+    return [convert_result(utils.loads(line)) for line in MAP[start:end].splitlines()]
+
+
+def convert_results(path, executor, manifest=None, chunk_size=256, window=1):
+    # Convert ranges of lines in workers, and yield results in the order of lines.
+    with open(path, "rb") as f:
+        offset = read_offset(path, manifest)
+        size = os.fstat(f.fileno()).st_size
+        if size > offset:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                yield from utils.parallel_map(
+                    executor,
+                    convert_range,
+                    split_lines(m, offset, chunk_size),
+                    window,
+                )
+                size = len(m)
+        if manifest is not None:
+            manifest.record(path, offset=size)
+
+
+def convert_result(result):
+    specialWeapons = []
+    for i in range(0, len(result["waves"])):
+        specialWeapon = []
+        if type(result["waves"][i]["special_uses"]) is dict:
+            for use in result["waves"][i]["special_uses"].values():
+                for _ in range(0, use["count"]):
+                    specialWeapon.append(
+                        construct_image_obj(
+                            "SpecialWeapon",
+                            SPECIAL_WEAPON_MAP[use["special"]["key"]],
+                            SPECIAL_WEAPON_IMAGE[
+                                SPECIAL_WEAPON_MAP[use["special"]["key"]]
+                            ],
+                        )
+                    )
+        specialWeapons.append(specialWeapon)
 
-            coops.append(
+    return {
+        "coopHistoryDetail": {
+            "__typename": "CoopHistoryDetail",
+            "id": construct_id(
+                "CoopHistoryDetail",
+                generate_dummy_npln_user_id(
+                    result["players"][0]["name"],
+                    result["players"][0]["number"],
+                ),
+                result["start_at"]["time"],
+                result["uuid"],
+            ),
+            "afterGrade": (
+                construct_obj(
+                    "CoopGrade",
+                    get_id_in_aliases(result["title_after"]),
+                )
+                if result["title_after"] != None
+                else None
+            ),
+            "myResult": construct_member_result(result, result["players"][0]),
+            "memberResults": list(
+                map(
+                    lambda x: construct_member_result(result, x),
+                    result["players"][1:],
+                )
+            ),
+            "bossResult": (
                 {
-                    "coopHistoryDetail": {
-                        "__typename": "CoopHistoryDetail",
-                        "id": construct_id(
-                            "CoopHistoryDetail",
-                            generate_dummy_npln_user_id(
-                                result["players"][0]["name"],
-                                result["players"][0]["number"],
+                    "boss": construct_image_obj(
+                        "CoopEnemy",
+                        get_id_in_aliases(result["king_salmonid"]),
+                        ENEMY_IMAGE[get_id_in_aliases(result["king_salmonid"])],
+                    ),
+                    "hasDefeatBoss": result["clear_extra"],
+                }
+                if result["king_salmonid"] != None
+                else None
+            ),
+            "enemyResults": (
+                list(
+                    map(
+                        lambda x: {
+                            "defeatCount": x["defeated_by_me"],
+                            "teamDefeatCount": x["defeated"],
+                            "popCount": x["appearances"],
+                            "enemy": construct_image_obj(
+                                "CoopEnemy",
+                                get_id_in_aliases(x["boss"]),
+                                ENEMY_IMAGE[get_id_in_aliases(x["boss"])],
                             ),
-                            result["start_at"]["time"],
-                            result["uuid"],
-                        ),
-                        "afterGrade": (
+                        },
+                        result["bosses"].values(),
+                    )
+                )
+                if type(result["bosses"]) is dict
+                else []
+            ),
+            "waveResults": list(
+                map(
+                    lambda x: {
+                        "waveNumber": x[0] + 1,
+                        "waterLevel": WATER_LEVEL_MAP[x[1]["tide"]["key"]],
+                        "eventWave": (
                             construct_obj(
-                                "CoopGrade",
-                                get_id_in_aliases(result["title_after"]),
+                                "CoopEventWave",
+                                EVENT_WAVE_MAP[x[1]["event"]["key"]],
                             )
-                            if result["title_after"] != None
+                            if x[1]["event"] != None
                             else None
                         ),
-                        "myResult": construct_member_result(
-                            result, result["players"][0]
-                        ),
-                        "memberResults": list(
-                            map(
-                                lambda x: construct_member_result(result, x),
-                                result["players"][1:],
-                            )
-                        ),
-                        "bossResult": (
-                            {
-                                "boss": construct_image_obj(
-                                    "CoopEnemy",
-                                    get_id_in_aliases(result["king_salmonid"]),
-                                    ENEMY_IMAGE[
-                                        get_id_in_aliases(result["king_salmonid"])
-                                    ],
-                                ),
-                                "hasDefeatBoss": result["clear_extra"],
-                            }
-                            if result["king_salmonid"] != None
-                            else None
-                        ),
-                        "enemyResults": (
-                            list(
-                                map(
-                                    lambda x: {
-                                        "defeatCount": x["defeated_by_me"],
-                                        "teamDefeatCount": x["defeated"],
-                                        "popCount": x["appearances"],
-                                        "enemy": construct_image_obj(
-                                            "CoopEnemy",
-                                            get_id_in_aliases(x["boss"]),
-                                            ENEMY_IMAGE[get_id_in_aliases(x["boss"])],
-                                        ),
-                                    },
-                                    result["bosses"].values(),
-                                )
-                            )
-                            if type(result["bosses"]) is dict
-                            else []
-                        ),
-                        "waveResults": list(
-                            map(
-                                lambda x: {
-                                    "waveNumber": x[0] + 1,
-                                    "waterLevel": WATER_LEVEL_MAP[x[1]["tide"]["key"]],
-                                    "eventWave": (
-                                        construct_obj(
-                                            "CoopEventWave",
-                                            EVENT_WAVE_MAP[x[1]["event"]["key"]],
-                                        )
-                                        if x[1]["event"] != None
-                                        else None
-                                    ),
-                                    "deliverNorm": x[1]["golden_quota"],
-                                    "goldenPopCount": x[1]["golden_appearances"],
-                                    "teamDeliverCount": x[1]["golden_delivered"],
-                                    "specialWeapons": specialWeapons[x[0]],
-                                },
-                                enumerate(result["waves"]),
-                            )
-                        ),
-                        "resultWave": (
-                            (
-                                result["clear_waves"] + 1
-                                if result["clear_waves"]
-                                is not (3 if not result.get("eggstra_work") else 5)
-                                else 0
-                            )
-                            if not result["players"][0]["disconnected"]
-                            else -1
-                        ),
-                        "playedTime": result["start_at"]["iso8601"].replace(
-                            "+00:00", "Z"
-                        ),
-                        "rule": (
-                            "TEAM_CONTEST"
-                            if result.get("eggstra_work")
-                            else ("BIG_RUN" if result["big_run"] else "REGULAR")
-                        ),
-                        "coopStage": construct_image_obj(
-                            "CoopStage",
-                            get_id_in_aliases(result["stage"]),
-                            COOP_STAGE_IMAGE[get_id_in_aliases(result["stage"])],
-                        ),
-                        "dangerRate": (
-                            (
-                                result["danger_rate"] / 100
-                                if result["danger_rate"] != None
-                                else result["waves"][-1]["danger_rate"] / 100
-                            )
-                            if not result["players"][0]["disconnected"]
-                            else 0
-                        ),
-                        "scenarioCode": None,
-                        "smellMeter": result["king_smell"],
-                        "weapons": [],
-                        "afterGradePoint": result["title_exp_after"],
-                        "scale": (
-                            {
-                                "gold": result["gold_scale"],
-                                "silver": result["silver_scale"],
-                                "bronze": result["bronze_scale"],
-                            }
-                            if result["gold_scale"] != None
-                            else None
-                        ),
-                        "jobPoint": result["job_point"],
-                        "jobScore": result["job_score"],
-                        "jobRate": result["job_rate"],
-                        "jobBonus": result["job_bonus"],
-                        "nextHistoryDetail": None,
-                        "previousHistoryDetail": None,
-                    }
+                        "deliverNorm": x[1]["golden_quota"],
+                        "goldenPopCount": x[1]["golden_appearances"],
+                        "teamDeliverCount": x[1]["golden_delivered"],
+                        "specialWeapons": specialWeapons[x[0]],
+                    },
+                    enumerate(result["waves"]),
+                )
+            ),
+            "resultWave": (
+                (
+                    result["clear_waves"] + 1
+                    if result["clear_waves"]
+                    is not (3 if not result.get("eggstra_work") else 5)
+                    else 0
+                )
+                if not result["players"][0]["disconnected"]
+                else -1
+            ),
+            "playedTime": result["start_at"]["iso8601"].replace("+00:00", "Z"),
+            "rule": (
+                "TEAM_CONTEST"
+                if result.get("eggstra_work")
+                else ("BIG_RUN" if result["big_run"] else "REGULAR")
+            ),
+            "coopStage": construct_image_obj(
+                "CoopStage",
+                get_id_in_aliases(result["stage"]),
+                COOP_STAGE_IMAGE[get_id_in_aliases(result["stage"])],
+            ),
+            "dangerRate": (
+                (
+                    result["danger_rate"] / 100
+                    if result["danger_rate"] != None
+                    else result["waves"][-1]["danger_rate"] / 100
+                )
+                if not result["players"][0]["disconnected"]
+                else 0
+            ),
+            "scenarioCode": None,
+            "smellMeter": result["king_smell"],
+            "weapons": [],
+            "afterGradePoint": result["title_exp_after"],
+            "scale": (
+                {
+                    "gold": result["gold_scale"],
+                    "silver": result["silver_scale"],
+                    "bronze": result["bronze_scale"],
                 }
-            )
+                if result["gold_scale"] != None
+                else None
+            ),
+            "jobPoint": result["job_point"],
+            "jobScore": result["job_score"],
+            "jobRate": result["job_rate"],
+            "jobBonus": result["job_bonus"],
+            "nextHistoryDetail": None,
+            "previousHistoryDetail": None,
+        }
+    }
 
-    utils.write_out("conch-bay-import", [], coops)
-    print(f'Export {len(coops)} coops to "conch-bay-import.zip".')
+
+def main():
+    if len(sys.argv) <= 1:
+        print(
+            f'Please specify the stat.ink Salmon Run JSON with "python3 {sys.argv[0]} <PATH>".'
+        )
+        return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    utils.add_output_arguments(argument_parser)
+    utils.add_resource_arguments(argument_parser)
+    utils.add_jobs_arguments(argument_parser)
+    args = argument_parser.parse_args()
+    warmup(utils.load_resources(args))
+
+    manifest = utils.load_manifest(args)
+
+    path = utils.output_path("conch-bay-import", manifest)
+    with (
+        concurrent.futures.ProcessPoolExecutor(
+            args.jobs,
+            initializer=init_worker,
+            initargs=(
+                args.path,
+                (UNIFORM_IMAGE, WEAPON_IMAGE, SPECIAL_WEAPON_IMAGE, COOP_STAGE_IMAGE),
+            ),
+        )
+        if args.jobs > 1
+        else contextlib.nullcontext()
+    ) as executor:
+        if executor is None:
+            coops = utils.pipe(read_results(args.path, manifest), convert_result)
+        else:
+            coops = convert_results(
+                args.path, executor, manifest, args.chunk_size, 2 * args.jobs
+            )
+        count = utils.write_out(path, [], coops, args.compress_level, manifest)
+    utils.print_export(count, path, manifest, "coops")
 
 
 if __name__ == "__main__":
@@ -1,59 +1,137 @@
 from base64 import b64decode
-import json
+import argparse
+import concurrent.futures
+import io
 import os
 import sys
-import tempfile
+import utils
 import zipfile
 
+ARCHIVE = None
+
+
+def init_worker(path):
+    global ARCHIVE
+    ARCHIVE = zipfile.ZipFile(path, "r")
+
+
+def read_result(name):
+    # Wrap the result by bytes without decoding it, and name it after the time in
+    # its ID.
+    data = ARCHIVE.read(name)
+    if name.startswith("battles/"):
+        id = utils.scan_id(io.BytesIO(data), "vsHistoryDetail")
+        time = b64decode(id).decode("utf-8").split(":")[2].split("_")[0]
+    else:
+        id = utils.scan_id(io.BytesIO(data), "coopHistoryDetail")
+        time = b64decode(id).decode("utf-8").split(":")[1].split("_")[0]
+    return time, b'{"data": ' + data.strip() + b"}"
+
+
+def write_file(dir, time, data):
+    # Results of the same second are numbered as utils.Writer does. Files are created
+    # exclusively, so workers do not overwrite each other's.
+    sequence = 1
+    while True:
+        try:
+            with open(
+                f"exports/{dir}/{time}{f'-{sequence}' if sequence > 1 else ''}.json",
+                "xb",
+            ) as f:
+                f.write(data)
+            return
+        except FileExistsError:
+            sequence += 1
+
+
+def export_files(names):
+    for name in names:
+        time, data = read_result(name)
+        write_file(
+            "results" if name.startswith("battles/") else "coop_results", time, data
+        )
+    return [len(names)]
+
+
+def export_bundle(bundle):
+    n, battles, coops = bundle
+    os.mkdir(f"export-{n}")
+    for file, names in [("results.json", battles), ("coop_results.json", coops)]:
+        with open(f"export-{n}/{file}", "wb") as f:
+            f.write(b"[")
+            for i, name in enumerate(names):
+                if i:
+                    f.write(b", ")
+                f.write(read_result(name)[1])
+            f.write(b"]")
+    return [len(battles) + len(coops)]
+
 
 def main():
     if len(sys.argv) <= 1:
         print(f'Please specify the results ZIP with "python3 {sys.argv[0]} <PATH>".')
         return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    argument_parser.add_argument(
+        "--bundle-size",
+        type=int,
+        default=None,
+        help="export bundles of results in export-*/results.json instead of a file per result",
+    )
+    utils.add_jobs_arguments(argument_parser, os.cpu_count())
+    args = argument_parser.parse_args()
 
-    if not os.path.exists("exports"):
-        os.mkdir("exports")
-    if len(os.listdir("exports")) != 0:
-        print('Folder "exports" is not empty. Aborted.')
-        return
-    os.mkdir("exports/results")
-    os.mkdir("exports/coop_results")
-    with open("exports/overview.json", "a", encoding="utf-8") as f:
-        f.write("[]\n")
-
-    dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(sys.argv[1], "r") as f:
-        f.extractall(dir)
-
-    count = 0
-    for path in os.listdir(f"{dir}/battles"):
-        with open(f"{dir}/battles/{path}", "r", encoding="utf-8") as f:
-            battle = json.loads(f.read())
-            time = (
-                b64decode(battle["vsHistoryDetail"]["id"])
-                .decode("utf-8")
-                .split(":")[2]
-                .split("_")[0]
-            )
-            result = {"data": battle}
-            with open(f"exports/results/{time}.json", "w", encoding="utf-8") as f2:
-                json.dump(result, f2, ensure_ascii=False)
-            count += 1
-    for path in os.listdir(f"{dir}/coops"):
-        with open(f"{dir}/coops/{path}", "r", encoding="utf-8") as f:
-            coop = json.loads(f.read())
-            time = (
-                b64decode(coop["coopHistoryDetail"]["id"])
-                .decode("utf-8")
-                .split(":")[1]
-                .split("_")[0]
+    if args.bundle_size is None:
+        if not os.path.exists("exports"):
+            os.mkdir("exports")
+        if len(os.listdir("exports")) != 0:
+            print('Folder "exports" is not empty. Aborted.')
+            return
+        os.mkdir("exports/results")
+        os.mkdir("exports/coop_results")
+        with open("exports/overview.json", "a", encoding="utf-8") as f:
+            f.write("[]\n")
+        output = "exports"
+    else:
+        if any(dir.startswith("export-") for dir in os.listdir(".")):
+            print('Folders "export-*" exist. Aborted.')
+            return
+        output = "export-*"
+
+    with zipfile.ZipFile(args.path, "r") as f:
+        names = [name for name in f.namelist() if not name.endswith("/")]
+    battles = [name for name in names if name.startswith("battles/")]
+    coops = [name for name in names if name.startswith("coops/")]
+
+    if args.bundle_size is None:
+        fn = export_files
+        tasks = utils.chunk(battles + coops, args.chunk_size)
+    else:
+        fn = export_bundle
+        battle_bundles = list(utils.chunk(battles, args.bundle_size))
+        coop_bundles = list(utils.chunk(coops, args.bundle_size))
+        tasks = [
+            (
+                n,
+                battle_bundles[n] if n < len(battle_bundles) else [],
+                coop_bundles[n] if n < len(coop_bundles) else [],
             )
-            result = {"data": coop}
-            with open(f"exports/coop_results/{time}.json", "w", encoding="utf-8") as f2:
-                json.dump(result, f2, ensure_ascii=False)
-            count += 1
+            for n in range(max(len(battle_bundles), len(coop_bundles)))
+        ]
+
+    # Results are read and written in workers, which open the archive themselves.
+    if args.jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            args.jobs, initializer=init_worker, initargs=(args.path,)
+        ) as executor:
+            count = sum(utils.parallel_map(executor, fn, tasks, 2 * args.jobs))
+    else:
+        init_worker(args.path)
+        with ARCHIVE:
+            count = sum(n for task in tasks for n in fn(task))
 
-    print(f'Export {count} results to "exports".')
+    print(f'Export {count} results to "{output}".')
 
 
 if __name__ == "__main__":
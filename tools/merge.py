@@ -0,0 +1,96 @@
+import argparse
+import contextlib
+import datetime
+import heapq
+import io
+import os
+import re
+import sys
+import utils
+import zipfile
+
+# Converters before numbering results of the same second named them
+# "{time}-{sequence}.json.json".
+NAME = re.compile(r"(\d+)(?:-(\d+))?\.json(?:\.json)?")
+
+
+def read_time(archive, name, key):
+    # The app imports entries of any name, whose time is read from the result.
+    with archive.open(name) as f:
+        played_time = utils.scan_value(f, key, "playedTime")
+    if type(played_time) is not str:
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(played_time.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return int(date.timestamp())
+
+
+def read_entries(archive, dir, key):
+    # Entries are usually named after the time of results, so they could be sorted
+    # without being read.
+    names = []
+    for name in archive.namelist():
+        if name.startswith(f"{dir}/") and not name.endswith("/"):
+            m = NAME.fullmatch(name, len(dir) + 1)
+            if m is not None:
+                names.append((int(m.group(1)), int(m.group(2) or 1), name))
+                continue
+            time = read_time(archive, name, key)
+            if time is None:
+                print(f'Skip "{name}" in "{archive.filename}" without a played time.')
+                continue
+            names.append((time, 1, name))
+    names.sort()
+    for time, _, name in names:
+        yield time, archive.read(name)
+
+
+def merge(archives, dir, key):
+    # Duplicates are played at the same time, so only IDs of results played at the
+    # current time are kept.
+    current = None
+    ids = set()
+    for time, data in heapq.merge(
+        *[read_entries(archive, dir, key) for archive in archives], key=lambda x: x[0]
+    ):
+        if time != current:
+            current = time
+            ids.clear()
+        id = utils.scan_id(io.BytesIO(data), key)
+        if id is None or id not in ids:
+            if id is not None:
+                ids.add(id)
+            yield time, id, data
+
+
+def main():
+    if len(sys.argv) <= 1:
+        print(
+            f'Please specify the results ZIPs with "python3 {sys.argv[0]} <PATH> [<PATH> ...]".'
+        )
+        return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("paths", nargs="+")
+    utils.add_output_arguments(argument_parser)
+    args = argument_parser.parse_args()
+    manifest = utils.load_manifest(args)
+
+    path = utils.output_path("conch-bay-import", manifest)
+    if os.path.abspath(f"{path}.zip") in map(os.path.abspath, args.paths):
+        print(f'"{path}.zip" could not be merged into itself. Aborted.')
+        return
+
+    with contextlib.ExitStack() as stack:
+        archives = [stack.enter_context(zipfile.ZipFile(p, "r")) for p in args.paths]
+        with utils.Writer(path, args.compress_level, manifest) as writer:
+            for time, id, data in merge(archives, "battles", "vsHistoryDetail"):
+                writer.write("battles", time, data, id)
+            for time, id, data in merge(archives, "coops", "coopHistoryDetail"):
+                writer.write("coops", time, data, id)
+    utils.print_export(writer.count, path, manifest)
+
+
+if __name__ == "__main__":
+    main()
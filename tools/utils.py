@@ -1,38 +1,579 @@
+import codecs
+import collections
+import concurrent.futures
 import datetime
+import functools
+import hashlib
+import itertools
 import json
+import math
 import os
-import shutil
-import tempfile
+import pickle
+import re
+import time
+import zipfile
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def write_out(path, battles, coops):
-    dir = tempfile.mkdtemp()
+RESOURCE_URL = "https://raw.githubusercontent.com/Leanny/splat3/main/data/mush"
+RESOURCE_VERSION_TTL = 24 * 60 * 60
+RESOURCE_TIMEOUT = (5, 30)
+RESOURCE_RETRIES = 3
+SCAN_SIZE = 4096
+ARRAY_BLOCK_SIZE = 64 * 1024
+TOKEN = re.compile(rb'[{}\[\]"]')
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+AFTER = re.compile(rb"\s*(.)", re.S)
+VALUE = re.compile(rb'\s*(?:("(?:[^"\\]|\\.)*"|[^\s"{}\[\],]+(?=[\s,}\]]))|[{\[])')
+WHITESPACE = re.compile(r"\s*")
+# Floats which orjson and the standard library format differently, in exponent
+# notation or below 1e-4.
+FLOAT = re.compile(rb"\de|0\.0000")
 
-    last_time = 0
-    duplicate = 0
-    os.mkdir(f"{dir}/battles")
-    for battle in battles:
+
+class Manifest:
+    # Records emitted results and read sources next to the output, so incremental
+    # runs only emit new results and interrupted runs could resume.
+    def __init__(self, path):
+        self.path = f"{path}.manifest.json"
+        self.runs = 0
+        self.ids = set()
+        self.sources = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.runs = data["runs"]
+            self.ids = set(data["ids"])
+            self.sources = data["sources"]
+
+    def source(self, path):
+        return self.sources.get(os.path.abspath(path), {})
+
+    def changed(self, path):
+        stat = os.stat(path)
+        source = self.source(path)
+        return (
+            source.get("mtime") != stat.st_mtime or source.get("size") != stat.st_size
+        )
+
+    def record(self, path, **info):
+        stat = os.stat(path)
+        self.sources[os.path.abspath(path)] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            **info,
+        }
+
+    def track(self, records, path, **info):
+        # Sources are only recorded after all of their records are read.
+        yield from records
+        self.record(path, **info)
+
+    def skip(self, records, key):
+        for record in records:
+            if key(record) not in self.ids:
+                yield record
+
+    def new(self, path, battles, coops, key=None):
+        # Skip unchanged sources, and results exported before if their IDs could be
+        # told before decoding.
+        if not self.changed(path):
+            return [], []
+        if key is not None:
+            battles = self.skip(battles, key)
+            coops = self.skip(coops, key)
+        return battles, self.track(coops, path)
+
+    def save(self):
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"runs": self.runs, "ids": sorted(self.ids), "sources": self.sources},
+                f,
+            )
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+class Writer:
+    def __init__(self, path, compresslevel=None, manifest=None):
+        self.path = f"{path}.zip"
+        self.compresslevel = compresslevel
+        self.manifest = manifest
+        self.zip = None
+        self.sequences = {}
+        self.count = 0
+        # Incremental runs only create archives once there are new results.
+        if manifest is None:
+            self.open()
+
+    def open(self):
+        self.zip = zipfile.ZipFile(
+            self.path,
+            "w",
+            zipfile.ZIP_STORED if self.compresslevel == 0 else zipfile.ZIP_DEFLATED,
+            compresslevel=self.compresslevel,
+        )
+        self.zip.mkdir("battles")
+        self.zip.mkdir("coops")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # Archives are closed and recorded on interruption too, so the next run
+        # resumes from the last written result.
+        if self.zip is not None:
+            self.zip.close()
+        if self.manifest is not None:
+            if self.zip is not None:
+                self.manifest.runs += 1
+            self.manifest.save()
+
+    def write(self, dir, time, data, id=None):
+        if self.manifest is not None and id is not None:
+            if id in self.manifest.ids:
+                return
+            self.manifest.ids.add(id)
+        if self.zip is None:
+            self.open()
+        # Results played at the same second are numbered in the same way as the app
+        # exports them, in any order.
+        sequence = self.sequences.get((dir, time), 0) + 1
+        self.sequences[(dir, time)] = sequence
+        self.zip.writestr(
+            f"{dir}/{time}{f'-{sequence}' if sequence > 1 else ''}.json", data
+        )
+        self.count += 1
+
+    def write_battle(self, battle):
         date = datetime.datetime.fromisoformat(battle["vsHistoryDetail"]["playedTime"])
-        time = int(date.timestamp())
-        if last_time == time:
-            duplicate += 1
-        else:
-            duplicate = 0
-        last_time = time
-        with open(f"{dir}/battles/{time}{f"-{duplicate}.json" if duplicate else ""}.json", "w", encoding="utf-8") as f:
-            json.dump(battle, f, ensure_ascii=False)
-    last_time = 0
-    duplicate = 0
-    os.mkdir(f"{dir}/coops")
-    for coop in coops:
+        self.write(
+            "battles",
+            int(date.timestamp()),
+            dumps(battle),
+            battle["vsHistoryDetail"]["id"],
+        )
+
+    def write_coop(self, coop):
         date = datetime.datetime.fromisoformat(coop["coopHistoryDetail"]["playedTime"])
-        time = int(date.timestamp())
-        if last_time == time:
-            duplicate += 1
+        self.write(
+            "coops",
+            int(date.timestamp()),
+            dumps(coop),
+            coop["coopHistoryDetail"]["id"],
+        )
+
+
+class Resources:
+    def __init__(self, url=RESOURCE_URL, cache_dir=None, offline=False, refresh=False):
+        # The URL could also be a local directory in the same layout.
+        self.url = url
+        self.dir = os.path.join(
+            cache_dir or default_cache_dir(),
+            hashlib.sha256(url.encode("utf-8")).hexdigest()[:16],
+        )
+        self.offline = offline
+        self.refresh = refresh
+        self.version = None
+        self.session = None
+
+    def get(self, path):
+        if os.path.isdir(self.url):
+            with open(f"{self.url}/{path}", "rb") as f:
+                return f.read()
+        if self.offline:
+            raise FileNotFoundError(f'Resource "{path}" is not cached.')
+        response = self.connect().get(f"{self.url}/{path}", timeout=RESOURCE_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    def connect(self):
+        if self.session is None:
+            import requests
+            import requests.adapters
+            import urllib3.util
+
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=16,
+                max_retries=urllib3.util.Retry(
+                    RESOURCE_RETRIES,
+                    backoff_factor=0.5,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                ),
+            )
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def save(self, path, data):
+        os.makedirs(os.path.dirname(f"{self.dir}/{path}"), exist_ok=True)
+        with open(f"{self.dir}/{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{self.dir}/{path}.tmp", f"{self.dir}/{path}")
+
+    def load(self, path, fetch):
+        if not self.refresh and os.path.exists(f"{self.dir}/{path}"):
+            with open(f"{self.dir}/{path}", "rb") as f:
+                return f.read()
+        data = fetch()
+        self.save(path, data)
+        return data
+
+    def fetch_version(self):
+        # The latest version is checked again once it expires unless offline.
+        if self.version is None:
+            path = f"{self.dir}/latest"
+            if (
+                not self.offline
+                and not self.refresh
+                and os.path.exists(path)
+                and time.time() - os.path.getmtime(path) > RESOURCE_VERSION_TTL
+            ):
+                # The expired version is only replaced once the latest one is
+                # fetched, so it is still used when the latest one could not be.
+                try:
+                    self.save("latest", self.get("latest"))
+                except OSError:
+                    pass
+            self.version = (
+                self.load("latest", lambda: self.get("latest")).decode("utf-8").strip()
+            )
+        return self.version
+
+    def fetch(self, name):
+        version = self.fetch_version()
+        return loads(
+            self.load(
+                f"{version}/{name}.json", lambda: self.get(f"{version}/{name}.json")
+            )
+        )
+
+    def fetch_all(self, names):
+        # Fetch resources concurrently through the same session, which is created
+        # before workers so they do not create their own.
+        self.fetch_version()
+        if not self.offline and not os.path.isdir(self.url):
+            self.connect()
+        with concurrent.futures.ThreadPoolExecutor(len(names)) as executor:
+            return list(executor.map(self.fetch, names))
+
+    def cache(self, name, build):
+        # Cache derived data of a version, such as image maps.
+        version = self.fetch_version()
+        return pickle.loads(
+            self.load(f"{version}/{name}.pickle", lambda: pickle.dumps(build()))
+        )
+
+
+def shared(fn):
+    # Cache objects built by fn, so results share the same object for the same
+    # arguments instead of building it again. Shared objects must be copied before
+    # being modified, or the change would show in every result.
+    return functools.lru_cache(maxsize=None)(fn)
+
+
+def loads(data):
+    # orjson rejects a few inputs the standard library accepts, such as NaN.
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def finite(obj):
+    if type(obj) is float:
+        return obj if math.isfinite(obj) else None
+    if type(obj) is dict:
+        return {key: finite(value) for key, value in obj.items()}
+    if type(obj) is list or type(obj) is tuple:
+        return [finite(value) for value in obj]
+    return obj
+
+
+def plain_floats(data):
+    # Tell if floats in JSON by orjson are formatted as the standard library does, by
+    # only scanning values out of strings. Escaped quotes could not be told from ends
+    # of strings, so JSON with them is never told to be plain.
+    if b'\\"' in data:
+        return False
+    return FLOAT.search(b"".join(data.split(b'"')[::2])) is None
+
+
+def dumps(obj):
+    # Encode compact JSON in UTF-8 as the app does. orjson gives the same bytes as
+    # the standard library except for floats in exponent notation or below 1e-4,
+    # which are encoded again by the standard library. Non-finite floats are written
+    # as null by both, since the app could not parse NaN or Infinity.
+    if orjson is not None:
+        try:
+            data = orjson.dumps(obj)
+            if plain_floats(data):
+                return data
+        except orjson.JSONEncodeError:
+            pass
+    try:
+        data = json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+        )
+    except ValueError:
+        data = json.dumps(finite(obj), ensure_ascii=False, separators=(",", ":"))
+    return data.encode("utf-8")
+
+
+def default_cache_dir():
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "conch-bay"
+    )
+
+
+def add_resource_arguments(argument_parser):
+    argument_parser.add_argument(
+        "--resource-url",
+        default=RESOURCE_URL,
+        help="URL or local directory of resources",
+    )
+    argument_parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="directory of cached resources",
+    )
+    argument_parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="only use cached resources",
+    )
+    argument_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="fetch resources again even if they are cached",
+    )
+
+
+def load_resources(args):
+    return Resources(args.resource_url, args.cache_dir, args.offline, args.refresh)
+
+
+def add_output_arguments(argument_parser):
+    argument_parser.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(0, 10),
+        default=None,
+        help="compression level of the archive, 0 to store results uncompressed",
+    )
+    argument_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only export results not exported by previous incremental runs",
+    )
+
+
+def load_manifest(args, path="conch-bay-import"):
+    return Manifest(path) if args.incremental else None
+
+
+def output_path(path, manifest=None):
+    # Incremental runs write numbered delta archives.
+    return f"{path}-{manifest.runs + 1}" if manifest is not None else path
+
+
+def print_export(count, path, manifest=None, kind="results"):
+    # Incremental runs without new results do not write archives.
+    if manifest is not None and count == 0:
+        print(f"No new {kind} to export, so no archive is written.")
+    else:
+        print(f'Export {count} {kind} to "{path}.zip".')
+
+
+def add_jobs_arguments(argument_parser, jobs=1):
+    argument_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=jobs,
+        help=f"number of worker processes, up to {os.cpu_count()} on this machine",
+    )
+    argument_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=256,
+        help="number of results sent to a worker at a time",
+    )
+
+
+def chunk(records, size):
+    records = iter(records)
+    while records_chunk := list(itertools.islice(records, size)):
+        yield records_chunk
+
+
+def parallel_map(executor, fn, chunks, window):
+    # The first chunks are submitted right away so several maps could run
+    # concurrently in the same executor. At most window chunks are in flight and
+    # results are yielded in order.
+    chunks = iter(chunks)
+    futures = collections.deque(
+        executor.submit(fn, c) for c in itertools.islice(chunks, window)
+    )
+
+    def results():
+        while futures:
+            future = futures.popleft()
+            for c in itertools.islice(chunks, 1):
+                futures.append(executor.submit(fn, c))
+            yield from future.result()
+
+    return results()
+
+
+def scan_key(f, *keys):
+    # Scan the file incrementally for the value under keys without decoding anything
+    # else. Return the buffer read so far and the position of the value in it.
+    keys = [json.dumps(key).encode("utf-8") for key in keys]
+    buf = b""
+    pos = 0
+    # Keys of objects being scanned, or None for arrays.
+    stack = []
+    while True:
+        m = TOKEN.search(buf, pos)
+        if m is not None:
+            pos = m.start()
+            c = buf[pos]
+            if c == 0x22:
+                s = STRING.match(buf, pos)
+                after = s and AFTER.match(buf, s.end())
+                if after:
+                    if after.group(1) != b":":
+                        pos = s.end()
+                        continue
+                    key = s.group()
+                    if key == keys[-1] and stack[:-1] == keys[:-1]:
+                        return buf, after.end()
+                    if stack:
+                        stack[-1] = key
+                    pos = after.end()
+                    continue
+            else:
+                if c == 0x7B or c == 0x5B:
+                    stack.append(None)
+                elif len(stack) > 1:
+                    stack.pop()
+                else:
+                    return None
+                pos += 1
+                continue
         else:
-            duplicate = 0
-        last_time = time
-        with open(f"{dir}/coops/{time}{f"-{duplicate}.json" if duplicate else ""}.json", "w", encoding="utf-8") as f:
-            json.dump(coop, f, ensure_ascii=False)
+            pos = len(buf)
+        # The token is incomplete, or there is no token left in the buffer.
+        data = f.read(SCAN_SIZE)
+        if not data:
+            return None
+        buf = buf[pos:] + data
+        pos = 0
+
+
+def scan_value(f, *keys):
+    # Scan the entry incrementally for the scalar value under keys, so only its head
+    # is usually decompressed and nothing else is decoded.
+    scanned = scan_key(f, *keys)
+    if scanned is None:
+        return None
+    buf, pos = scanned
+    while (value := VALUE.match(buf, pos)) is None:
+        data = f.read(SCAN_SIZE)
+        if not data:
+            return None
+        buf += data
+    if value.group(1) is None:
+        return None
+    return json.loads(value.group(1))
+
+
+def scan_id(f, *keys):
+    return scan_value(f, *keys, "id")
+
+
+def read_array(f, *keys):
+    # Decode elements of the JSON array under keys one at a time, so only an element
+    # and a block are kept in memory. Blocks grow when an element is larger than a
+    # block.
+    if keys:
+        scanned = scan_key(f, *keys)
+        if scanned is None:
+            return
+    else:
+        scanned = b"", 0
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    decoder = json.JSONDecoder()
+    buf = utf8.decode(scanned[0][scanned[1] :])
+    pos = 0
+    size = ARRAY_BLOCK_SIZE
+    started = False
+    while True:
+        m = WHITESPACE.match(buf, pos)
+        pos = m.end()
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise json.JSONDecodeError("Expecting '['", buf, pos)
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            if buf[pos] == ",":
+                pos += 1
+                continue
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+                # Make sure the element is not cut at the end of the block. A cut
+                # number could still be decoded, like 1.5 of 1.5e3, so the element is
+                # only taken if the array continues right after it.
+                after = WHITESPACE.match(buf, end).end()
+                if after < len(buf) and buf[after] in ",]":
+                    yield element
+                    pos = end
+                    size = ARRAY_BLOCK_SIZE
+                    continue
+            except json.JSONDecodeError:
+                size *= 2
+        data = f.read(size)
+        if not data:
+            if pos < len(buf):
+                decoder.raw_decode(buf, pos)
+            raise json.JSONDecodeError("Expecting ']'", buf, len(buf))
+        buf = buf[pos:] + utf8.decode(data)
+        pos = 0
+
+
+def pipe(records, *transforms):
+    for record in records:
+        for transform in transforms:
+            record = transform(record)
+        yield record
+
+
+def unique(records, key, ids=None):
+    if ids is None:
+        ids = set()
+    for record in records:
+        id = key(record)
+        if id not in ids:
+            ids.add(id)
+            yield record
+
 
-    shutil.make_archive(path, "zip", dir)
+def write_out(path, battles, coops, compresslevel=None, manifest=None):
+    with Writer(path, compresslevel, manifest) as writer:
+        for battle in battles:
+            writer.write_battle(battle)
+        for coop in coops:
+            writer.write_coop(coop)
+    return writer.count
@@ -1,49 +1,268 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
 import json
 import os
 import sys
-import tempfile
+import time
+import utils
 import zipfile
 
 
+def require(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"expected a non-empty string, got {value!r}")
+    return value
+
+
+def check_played_time(detail):
+    return int(
+        datetime.datetime.fromisoformat(
+            require(detail["playedTime"]).replace("Z", "+00:00")
+        ).timestamp()
+    )
+
+
+def check_battle_weapon(detail):
+    players = [player for player in detail["myTeam"]["players"] if player["isMyself"]]
+    if not players:
+        raise ValueError("no player of myself")
+    require(players[0]["weapon"]["id"])
+
+
+def check_battle_players(detail):
+    for player in detail["myTeam"]["players"]:
+        require(player["id"])
+    for team in detail["otherTeams"]:
+        for player in team["players"]:
+            require(player["id"])
+
+
+def check_coop_weapons(detail):
+    for weapon in detail["myResult"]["weapons"]:
+        require(weapon["image"]["url"])
+
+
+def check_coop_players(detail):
+    require(detail["myResult"]["player"]["id"])
+    for member_result in detail["memberResults"]:
+        require(member_result["player"]["id"])
+
+
+# Fields indexed by the app in the brief table, see utils/database.ts.
+CHECKS = {
+    "battles": [
+        ("id", lambda x: require(x["id"])),
+        ("playedTime", check_played_time),
+        ("mode", lambda x: require(x["vsMode"]["id"])),
+        ("rule", lambda x: require(x["vsRule"]["id"])),
+        ("stage", lambda x: require(x["vsStage"]["id"])),
+        ("weapons", check_battle_weapon),
+        ("players", check_battle_players),
+    ],
+    "coops": [
+        ("id", lambda x: require(x["id"])),
+        ("playedTime", check_played_time),
+        ("rule", lambda x: require(x["rule"])),
+        ("stage", lambda x: require(x["coopStage"]["id"])),
+        ("weapons", check_coop_weapons),
+        ("players", check_coop_players),
+    ],
+}
+
+
+def scan_entry(archive, name):
+    key = "vsHistoryDetail" if name.startswith("battles/") else "coopHistoryDetail"
+    try:
+        with archive.open(name) as f:
+            return utils.scan_id(f, key)
+    except Exception:
+        return None
+
+
+def check_entry(archive, name):
+    # Return the ID, the played time, errors and nanoseconds spent in each check of
+    # the entry.
+    dir = name.split("/", 1)[0]
+    key = "vsHistoryDetail" if dir == "battles" else "coopHistoryDetail"
+    values = {}
+    errors = {}
+    timings = {}
+    start = time.perf_counter_ns()
+    try:
+        detail = utils.loads(archive.read(name))[key]
+        if not isinstance(detail, dict):
+            raise ValueError(f'"{key}" is not an object')
+    except Exception as e:
+        detail = None
+        errors["decode"] = f"{type(e).__name__}: {e}"
+    timings["decode"] = time.perf_counter_ns() - start
+    if detail is not None:
+        for check, fn in CHECKS[dir]:
+            start = time.perf_counter_ns()
+            try:
+                values[check] = fn(detail)
+            except Exception as e:
+                errors[check] = f"{type(e).__name__}: {e}"
+            timings[check] = time.perf_counter_ns() - start
+    return values.get("id"), values.get("playedTime"), errors, timings
+
+
+ARCHIVE = None
+
+
+def init_worker(path):
+    global ARCHIVE
+    ARCHIVE = zipfile.ZipFile(path, "r")
+
+
+def scan_entries(names):
+    return [scan_entry(ARCHIVE, name) for name in names]
+
+
+def check_entries(names):
+    return [check_entry(ARCHIVE, name) for name in names]
+
+
+def read_entries(path, jobs, chunk_size, fn, fn_in_worker):
+    # Yield (name, result of fn) of entries in the order of the archive.
+    with zipfile.ZipFile(path, "r") as archive:
+        names = [
+            name
+            for name in archive.namelist()
+            if not name.endswith("/") and name.startswith(("battles/", "coops/"))
+        ]
+        if jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                jobs, initializer=init_worker, initargs=(path,)
+            ) as executor:
+                yield from zip(
+                    names,
+                    utils.parallel_map(
+                        executor,
+                        fn_in_worker,
+                        utils.chunk(names, chunk_size),
+                        2 * jobs,
+                    ),
+                )
+        else:
+            yield from zip(names, (fn(archive, name) for name in names))
+
+
+def report(path, jobs, chunk_size, max_errors):
+    start = time.perf_counter()
+    ids = set()
+    results = {
+        dir: {
+            "total": 0,
+            "valid": 0,
+            "invalid": 0,
+            "duplicateIds": 0,
+            "duplicateTimes": 0,
+        }
+        for dir in CHECKS
+    }
+    times = {dir: collections.Counter() for dir in CHECKS}
+    checks = {}
+    errors = []
+    for name, (id, played_time, entry_errors, timings) in read_entries(
+        path, jobs, chunk_size, check_entry, check_entries
+    ):
+        dir = name.split("/", 1)[0]
+        result = results[dir]
+        result["total"] += 1
+        for check, elapsed in timings.items():
+            stats = checks.setdefault(
+                f"{dir}/{check}", {"checked": 0, "failed": 0, "seconds": 0}
+            )
+            stats["checked"] += 1
+            stats["seconds"] += elapsed / 1e9
+        for check, error in entry_errors.items():
+            checks[f"{dir}/{check}"]["failed"] += 1
+            if len(errors) < max_errors:
+                errors.append({"entry": name, "check": check, "error": error})
+        # Results played at the same second are allowed, but are worth a look.
+        if played_time is not None:
+            times[dir][played_time] += 1
+            if times[dir][played_time] == 2:
+                result["duplicateTimes"] += 1
+        if entry_errors:
+            result["invalid"] += 1
+        elif id in ids:
+            result["duplicateIds"] += 1
+        else:
+            ids.add(id)
+            result["valid"] += 1
+    for stats in checks.values():
+        stats["perSecond"] = (
+            stats["checked"] / stats["seconds"] if stats["seconds"] else None
+        )
+    seconds = time.perf_counter() - start
+    total = sum(result["total"] for result in results.values())
+    return {
+        "path": path,
+        "valid": all(
+            result["invalid"] == 0 and result["duplicateIds"] == 0
+            for result in results.values()
+        ),
+        **results,
+        "checks": checks,
+        "errors": errors,
+        "seconds": seconds,
+        "perSecond": total / seconds if seconds else None,
+    }
+
+
 def main():
     if len(sys.argv) <= 1:
         print(f'Please specify the results JSON with "python3 {sys.argv[0]} <PATH>".')
         return
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("path")
+    argument_parser.add_argument(
+        "--json",
+        action="store_true",
+        help="check fields indexed by the app and print a report in JSON",
+    )
+    argument_parser.add_argument(
+        "--max-errors",
+        type=int,
+        default=100,
+        help="maximum number of errors listed in the report",
+    )
+    utils.add_jobs_arguments(argument_parser, os.cpu_count())
+    args = argument_parser.parse_args()
 
-    dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(sys.argv[1], "r") as f:
-        f.extractall(dir)
+    if args.json:
+        # Exit with an error if the archive is invalid, so imports could be gated.
+        result = report(args.path, args.jobs, args.chunk_size, args.max_errors)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if not result["valid"]:
+            sys.exit(1)
+        return
 
     ids = set()
     battles = 0
     valid_battles = 0
     coops = 0
     valid_coops = 0
-    for path in os.listdir(f"{dir}/battles"):
-        with open(f"{dir}/battles/{path}", "r", encoding="utf-8") as f:
-            battle = json.loads(f.read())
+    for name, id in read_entries(
+        args.path, args.jobs, args.chunk_size, scan_entry, scan_entries
+    ):
+        if name.startswith("battles/"):
             battles += 1
-            try:
-                id = battle["vsHistoryDetail"]["id"]
-                if id not in ids:
-                    ids.add(id)
-                    valid_battles += 1
-            except:
-                pass
-    for path in os.listdir(f"{dir}/coops"):
-        with open(f"{dir}/coops/{path}", "r", encoding="utf-8") as f:
-            coop = json.loads(f.read())
+        else:
             coops += 1
-            try:
-                id = coop["coopHistoryDetail"]["id"]
-                if id not in ids:
-                    ids.add(id)
-                    valid_coops += 1
-            except:
-                pass
+        if id is not None and id not in ids:
+            ids.add(id)
+            if name.startswith("battles/"):
+                valid_battles += 1
+            else:
+                valid_coops += 1
 
     print(
-        f'"{sys.argv[1]}" contains {valid_battles} (of {battles}) valid battles and {valid_coops} (of {coops}) valid coops.'
+        f'"{args.path}" contains {valid_battles} (of {battles}) valid battles and {valid_coops} (of {coops}) valid coops.'
     )
 
 